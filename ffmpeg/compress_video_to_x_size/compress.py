@@ -1,17 +1,25 @@
 
 import os
 import subprocess
-import tempfile
 import argparse
 import datetime
 
 from subprocess import PIPE
 
+from probe import ProbeCache, ProbeError, probe_file, probe_files, get_duration, DEFAULT_PROBE_CACHE_FILE, DEFAULT_PROBE_JOBS
+from scheduler import run_jobs, print_summary, get_threads_per_job, DEFAULT_JOBS
+from workspace import Workspace
+from encoders import get_encoder, add_encoder_arguments, check_encoder_arguments, DEFAULT_ENCODER
+
 
 FFMPEG = os.path.join(os.path.dirname(__file__), "..\\.ffmpeg\\ffmpeg.exe")
 FFPROBE = os.path.join(os.path.dirname(__file__), "..\\.ffmpeg\\ffprobe.exe")
 
 
+class CompressError(Exception):
+    """raised by the jobs of main when compress_video_file fails"""
+
+
 def get_parser():
 
     parser = argparse.ArgumentParser(
@@ -63,9 +71,66 @@ def get_parser():
         help="Specify the path to ffprobe"
     )
 
+    probe_ops = parser.add_argument_group("Probe Options")
+    probe_ops.add_argument(
+        "--probe-jobs",
+        dest="probe_jobs", metavar="N", type=int, default=DEFAULT_PROBE_JOBS,
+        help="Number of ffprobe processes run at once while reading the inputs (default %(default)s)"
+    )
+    probe_ops.add_argument(
+        "--probe-cache",
+        dest="probe_cache", metavar="FILE", default=DEFAULT_PROBE_CACHE_FILE,
+        help="Where ffprobe results are cached by path, size and date modified (default %(default)s)"
+    )
+    probe_ops.add_argument(
+        "--no-probe-cache",
+        dest="no_probe_cache", action="store_true",
+        help="Do not read or write the probe cache"
+    )
+
+    add_encoder_arguments(parser)
+
+    parallel = parser.add_argument_group("Parallel Options")
+    parallel.add_argument(
+        "-j", "--jobs",
+        dest="jobs", metavar="N", type=int, default=DEFAULT_JOBS,
+        help="Number of files encoded at once (default %(default)s)"
+    )
+    parallel.add_argument(
+        "--threads",
+        dest="threads", metavar="N", type=int,
+        help="The -threads given to each ffmpeg process (default the cpu count divided by the jobs)"
+    )
+    parallel.add_argument(
+        "--temp-dir",
+        dest="temp_dir", metavar="DIRECTORY",
+        help="Where each job keeps its two pass logs, removed when the job ends (default the system temp directory)"
+    )
+
     return parser
 
 
+def get_jobs_threads(args):
+    """(jobs, ffmpeg threads per job) from the parallel options of get_parser"""
+
+    jobs = max(1, args.jobs)
+
+    return (jobs, args.threads or get_threads_per_job(jobs))
+
+
+def probe_inputs(paths, args, ffprobe):
+    """Probes every input up front with the probe options of get_parser, returns a dict of path -> probe json or exception"""
+
+    cache = None if args.no_probe_cache else ProbeCache(args.probe_cache)
+
+    try:
+        return probe_files(paths, ffprobe, jobs = args.probe_jobs, cache = cache)
+
+    finally:
+        if cache:
+            cache.close()
+
+
 def parse_float(value, default=0):
     if not value:
         return default
@@ -85,10 +150,16 @@ def set_date_modified(file_path, date_time):
 def compress_video_file(file_path, output_file_path,
                         target_file_size_mb, *, FFMPEG_PATH=FFMPEG,
                         FFPROBE_PATH=FFPROBE, PRINT=False,
-                        NO_AUDIO=False, AUDIO_ONLY=False):
-
-
+                        NO_AUDIO=False, AUDIO_ONLY=False, PROBE=None, THREADS=None,
+                        TEMP_DIR=None, CODEC=DEFAULT_ENCODER, PRESET=None, TUNE=None):
+    """
+    Two pass encodes a file to about the target size, returns (success, error message)
 
+    PROBE is the ffprobe json of the file from probe_files, it is probed here when not given
+    THREADS is the -threads given to ffmpeg, ffmpeg picks when not given
+    TEMP_DIR is where the pass logs are written, the system temp directory when not given
+    CODEC is a key of encoders.ENCODERS, PRESET and TUNE are given to it, the encoders own defaults when not given
+    """
 
     # https://trac.ffmpeg.org/wiki/Encode/H.264#twopass
 
@@ -96,10 +167,17 @@ def compress_video_file(file_path, output_file_path,
     if not os.path.isfile(file_path):
         return (False, f"Path: {file_path} does not exist")
 
-    duration = subprocess.run([FFPROBE_PATH, '-v', 'quiet', '-show_entries', 'format=duration', '-of','csv=p=0', file_path],
-        shell=False, stdout=PIPE)
+    if isinstance(PROBE, Exception):
+        return (False, str(PROBE))
+
+    if PROBE is None:
+        try:
+            PROBE = probe_file(file_path, FFPROBE_PATH)
+
+        except ProbeError as e:
+            return (False, str(e))
 
-    duration = parse_float(duration.stdout.decode(), -1)
+    duration = get_duration(PROBE)
 
     if duration <= 0:
         if PRINT:
@@ -120,53 +198,67 @@ def compress_video_file(file_path, output_file_path,
     else:
         no_temp = "/dev/null"
 
-    # the .log file ffmpeg will create, just use a temp file
-    two_pass_log = os.path.join(tempfile.gettempdir(), "ffmpeg2pass-0.log")
+    # the pass logs and the temp output of this file, removed however the encode ends
+    with Workspace(TEMP_DIR) as workspace:
 
-    if AUDIO_ONLY:
-        audio_bitrate = total_bitrate
-        video_bitrate = 0 
+        two_pass_log = workspace.passlog
 
-        p1 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y',
-                            '-i', file_path, '-b:a', str(audio_bitrate) + 'k',
-                            '-pass', '1', "-vn", '-f', 'mp3',
-                            '-passlogfile', two_pass_log, no_temp], stdout=PIPE, stderr=PIPE)
+        # encode into a temp file, it only gets the real name once both passes worked
+        output = workspace.output(output_file_path)
 
-        p2 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
-                    '-i', file_path, '-b:a', str(audio_bitrate) + 'k',
-                    '-pass', '2', "-vn", '-f', 'mp3', 
-                    '-passlogfile', two_pass_log, str(output_file_path)], stdout=PIPE, stderr=PIPE) 
+        threads = ['-threads', str(THREADS)] if THREADS else []
 
-    else:
-        p1 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
-                        '-i', file_path, '-c:v', 'libx264', '-b:v', str(video_bitrate) + 'k',
-                        '-pass', '1', '-an', '-f', 'mp4', '-passlogfile', two_pass_log, no_temp], stdout=PIPE, stderr=PIPE)
+        if AUDIO_ONLY:
+            audio_bitrate = total_bitrate
+            video_bitrate = 0 
+
+            p1 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y',
+                                '-i', file_path, '-b:a', str(audio_bitrate) + 'k',
+                                '-pass', '1', "-vn", '-f', 'mp3',
+                                *threads, '-passlogfile', two_pass_log, no_temp], stdout=PIPE, stderr=PIPE)
 
-        # keep audio 
-        if not NO_AUDIO:
             p2 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
-                        '-i', file_path, '-c:v', 'libx264', '-b:v', str(video_bitrate) + 'k',
-                        '-pass', '2', '-c:a', 'aac', '-b:a', str(audio_bitrate) + 'k',  
-                        '-passlogfile', two_pass_log, str(output_file_path)], stdout=PIPE, stderr=PIPE)
-        
-        # remove audio from the video 
+                        '-i', file_path, '-b:a', str(audio_bitrate) + 'k',
+                        '-pass', '2', "-vn", '-f', 'mp3', 
+                        *threads, '-passlogfile', two_pass_log, output], stdout=PIPE, stderr=PIPE) 
+
         else:
-            p2 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
-                        '-i', file_path, '-c:v', 'libx264', '-b:v', str(video_bitrate) + 'k',
-                        '-pass', '2', '-an',
-                        '-passlogfile', two_pass_log, str(output_file_path)], stdout=PIPE, stderr=PIPE)
+            encoder = get_encoder(CODEC)
+
+            # encoders that cannot do two passes only run pass 2
+            if encoder.two_pass:
+                p1 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
+                                '-i', file_path, *encoder.get_args(video_bitrate, 1, two_pass_log, PRESET, TUNE, THREADS),
+                                '-an', '-f', 'mp4', no_temp], stdout=PIPE, stderr=PIPE)
+
+            else:
+                p1 = None
+
+            # keep audio 
+            if not NO_AUDIO:
+                p2 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
+                            '-i', file_path, *encoder.get_args(video_bitrate, 2, two_pass_log, PRESET, TUNE, THREADS), *encoder.mux_args,
+                            '-c:a', 'aac', '-b:a', str(audio_bitrate) + 'k', output], stdout=PIPE, stderr=PIPE)
+        
+            # remove audio from the video 
+            else:
+                p2 = subprocess.run([FFMPEG_PATH, '-v', 'error', '-y', 
+                            '-i', file_path, *encoder.get_args(video_bitrate, 2, two_pass_log, PRESET, TUNE, THREADS), *encoder.mux_args,
+                            '-an', output], stdout=PIPE, stderr=PIPE)
+
+        p1err = p1.stderr.decode() if p1 else ""
+        p2err = p2.stderr.decode()
 
-    p1err = p1.stderr.decode()
-    p2err = p2.stderr.decode()
+        if p1err != "":
+            return (False, p1err)
 
-    if p1err != "":
-        return (False, p1err)
+        if p2err != "":
+            return (False, p2err)
 
-    if p2err != "":
-        return (False, p2err)
+        workspace.finish(output, output_file_path)
 
-    # set the date modified of the new file to the same as the old file
-    set_date_modified(output_file_path, datetime.datetime.fromtimestamp(os.path.getmtime(file_path)))
+        # set the date modified of the new file to the same as the old file
+        set_date_modified(output_file_path, datetime.datetime.fromtimestamp(os.path.getmtime(file_path)))
 
     if PRINT:
         print("video bitrate: " + str(video_bitrate))
@@ -176,11 +268,34 @@ def compress_video_file(file_path, output_file_path,
 
     return (True , "")
 
-def main(_args):
-    
+def replace_original(i, tmp_name, ext):
+    """Replaces the file i with its compressed tmp_name, adding ext to the name when i does not end with it"""
+
     from time import sleep
     from random import random
 
+    sleep(1)
+
+    tmp = os.path.join(".TMP", os.path.basename(i) + str(random()) + ".BAK")
+
+    try:
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        os.rename(i, tmp)
+
+        if i.lower().strip().endswith(ext):
+            os.rename(tmp_name, i)
+        else:
+            os.rename(tmp_name, i + ext)
+
+        os.unlink(tmp)
+        os.removedirs(os.path.dirname(tmp))
+    except:
+        os.rename(tmp, i)
+        print("\033[91mUnable to delete/overwrite the old file.\nTemp path: " + tmp + "\nOriginal path: " + i + "\033[0m")
+
+
+def main(_args):
+    
     parser = get_parser()
     args = parser.parse_args(_args)
 
@@ -207,51 +322,60 @@ def main(_args):
     if args.audioonly and args.noaudio:
         parser.error("Audio Only cannot be used with No Audio")
 
+    check_encoder_arguments(parser, args)
+
     os.system("") # enable color in windows
 
-    total = len(args.inputs)
-    c = 1
-    for i in args.inputs:
-        print(f"working... ({c}/{total})")
+    # every input is probed at once before the first encode starts
+    probes = probe_inputs([i for i in args.inputs if os.path.isfile(i)], args, probe)
 
-        if args.audioonly:
-            ext = ".mp3"
+    (jobs, threads) = get_jobs_threads(args)
 
-        else:
-            ext = ".mp4"
+    if args.audioonly:
+        ext = ".mp3"
+
+    else:
+        ext = ".mp4"
 
-        tmp_name = i + "RE9ORQ0K.tmp" + ext
+    def encode(i):
 
-        if args.overwrite:
-            if compress_video_file(i, tmp_name, float(target), FFMPEG_PATH=peg, FFPROBE_PATH=probe, PRINT=True, NO_AUDIO=args.noaudio, AUDIO_ONLY=args.audioonly):
-                
-                sleep(1)
+        (ok, error) = compress_video_file(i, i + "RE9ORQ0K.tmp" + ext, float(target), FFMPEG_PATH=peg, FFPROBE_PATH=probe,
+                                          PRINT=jobs == 1, NO_AUDIO=args.noaudio, AUDIO_ONLY=args.audioonly,
+                                          PROBE=probes.get(i), THREADS=threads, TEMP_DIR=args.temp_dir,
+                                          CODEC=args.codec, PRESET=args.preset, TUNE=args.tune)
 
-                tmp = os.path.join(".TMP", os.path.basename(i) + str(random()) + ".BAK")
+        if not ok:
+            raise CompressError(error.strip())
 
-                try:
-                    os.makedirs(os.path.dirname(tmp), exist_ok=True)
-                    os.rename(i, tmp)
+    total = len(args.inputs)
+    c = 0
+
+    # runs on the main thread as each file finishes, so the originals are replaced one at a time
+    def finished(result):
+        nonlocal c
 
-                    if i.lower().strip().endswith(ext):
-                        os.rename(tmp_name, i)
-                    else:
-                        os.rename(tmp_name, i + ext)
+        c += 1
+        i = result.item
 
-                    os.unlink(tmp)
-                    os.removedirs(os.path.dirname(tmp))
-                except:
-                    os.rename(tmp, i)
-                    print("\033[91mUnable to delete/overwrite the old file.\nTemp path: " + tmp + "\nOriginal path: " + i + "\033[0m")
+        if not result.ok:
+            print(f"\033[91m({c}/{total}) {i} -> ERROR: {result.error}\033[0m")
 
         else:
-            compress_video_file(i, tmp_name, float(target), FFMPEG_PATH=peg, FFPROBE_PATH=probe, PRINT=True, NO_AUDIO=args.noaudio, AUDIO_ONLY=args.audioonly)
+            if args.overwrite:
+                replace_original(i, i + "RE9ORQ0K.tmp" + ext, ext)
 
-        c += 1
+            print(f"({c}/{total}) {i} -> done in {result.seconds:.1f}s")
 
-        if c <= total:
+        if c < total:
             print("=" * 20)
 
+    print(f"encoding {total} files, {jobs} at once with {threads} threads each")
+
+    (results, wall) = run_jobs(args.inputs, encode, jobs = jobs, on_done = finished)
+
+    print("=" * 20)
+    print_summary(results, wall)
+
     print("\033[92mDone.\033[0m")
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+
+# Encodes a short sample of each input with every encoder profile, to pick the speed / size trade off of a batch
+#
+#   python encoder_benchmark.py -i video.mp4                  (the default profiles)
+#   python encoder_benchmark.py -i video.mp4 -P x264:veryfast -P x265:slow -s 20
+#
+# every profile encodes the same sample (video only) at the constant quality of its encoder (Encoder.crf),
+# then the encode speed, the size and the ssim against the sample are printed
+
+import os
+import re
+import time
+import subprocess
+
+from subprocess import PIPE
+
+from compress import FFMPEG, FFPROBE
+from probe import ProbeError, probe_file, get_duration
+from encoders import ENCODERS, get_encoder
+from workspace import Workspace
+
+
+# codec:preset
+DEFAULT_PROFILES = ("x264:veryfast", "x264:medium", "x264:slow", "x265:medium", "vp9:4", "av1-svt:8")
+
+DEFAULT_SAMPLE_DURATION = 10
+
+
+def parse_profile(value):
+    """(Encoder, preset) from codec or codec:preset, raises ValueError for an unknown codec or preset"""
+
+    (name, _, preset) = value.partition(":")
+
+    encoder = get_encoder(name)
+    encoder.check(preset or None, None)
+
+    return (encoder, preset or None)
+
+
+def cut_sample(path, output, start, duration, ffmpeg):
+    """Copies duration seconds of the first video stream of path from start into output, without re-encoding"""
+
+    p = subprocess.run([ffmpeg, '-v', 'error', '-y', '-ss', f"{start:.3f}", '-i', path, '-t', f"{duration:.3f}",
+                        '-map', '0:V:0', '-c', 'copy', output], stdout=PIPE, stderr=PIPE)
+
+    if p.stderr:
+        raise OSError(p.stderr.decode().strip())
+
+
+def encode_sample(sample, output, encoder, preset, tune, threads, ffmpeg):
+    """Encodes the sample at the constant quality of the encoder, returns (seconds taken, frames encoded)"""
+
+    start = time.perf_counter()
+
+    p = subprocess.run([ffmpeg, '-v', 'error', '-y', '-nostats', '-progress', 'pipe:1', '-i', sample,
+                        *encoder.get_args(None, None, None, preset, tune, threads), '-an', output], stdout=PIPE, stderr=PIPE)
+
+    seconds = time.perf_counter() - start
+
+    if p.stderr:
+        raise OSError(p.stderr.decode().strip())
+
+    frames = re.findall(rb"^frame=(\d+)", p.stdout, re.M)
+
+    return (seconds, int(frames[-1]) if frames else 0)
+
+
+def measure_ssim(encoded, sample, ffmpeg):
+    """The ssim (All) of the encoded file against the sample, None when ffmpeg does not print one"""
+
+    p = subprocess.run([ffmpeg, '-v', 'info', '-nostats', '-i', encoded, '-i', sample,
+                        '-lavfi', '[0:v][1:v]ssim', '-f', 'null', '-'], stdout=PIPE, stderr=PIPE)
+
+    match = re.search(rb"All:([0-9.]+)", p.stderr)
+
+    return float(match.group(1)) if match else None
+
+
+def get_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]... -i FILE...",
+        add_help=False,
+    )
+
+    general = parser.add_argument_group("General Options")
+    general.add_argument(
+        "-h", "--help",
+        action="help",
+        help="Print this help message and exit",
+    )
+    general.add_argument(
+        "-i", "--input",
+        dest="inputs", metavar="FILE", action="append",
+        help="Specify input file. multiple -i can specified"
+    )
+    general.add_argument(
+        "-fp", "--ffmpeg",
+        dest="ffmpeg_path", metavar="PATH", default=FFMPEG,
+        help="Specify the path to ffmpeg"
+    )
+    general.add_argument(
+        "-fb", "--ffprobe",
+        dest="ffprobe_path", metavar="PATH", default=FFPROBE,
+        help="Specify the path to ffprobe"
+    )
+
+    bench_ops = parser.add_argument_group("Benchmark Options")
+    bench_ops.add_argument(
+        "-P", "--profile",
+        dest="profiles", metavar="CODEC[:PRESET]", action="append",
+        help=f"Encoder profile to benchmark, multiple -P can be specified, codecs are {', '.join(ENCODERS)} "
+             f"(default {' '.join(DEFAULT_PROFILES)})"
+    )
+    bench_ops.add_argument(
+        "--tune",
+        dest="tune", metavar="TUNE",
+        help="The tune given to every profile whose encoder has it"
+    )
+    bench_ops.add_argument(
+        "-s", "--sample",
+        dest="sample", metavar="SECONDS", type=float, default=DEFAULT_SAMPLE_DURATION,
+        help="Length of the sample cut from a third of the way into each input (default %(default)s)"
+    )
+    bench_ops.add_argument(
+        "--threads",
+        dest="threads", metavar="N", type=int,
+        help="The -threads given to each encode (default ffmpeg picks)"
+    )
+    bench_ops.add_argument(
+        "--no-ssim",
+        dest="no_ssim", action="store_true",
+        help="Do not measure the ssim of each encode, which decodes it again"
+    )
+
+    return parser
+
+
+def main(_args = None):
+
+    parser = get_parser()
+    args = parser.parse_args(_args)
+
+    if not args.inputs:
+        parser.error("no input file specified")
+
+    profiles = []
+
+    for i in args.profiles or DEFAULT_PROFILES:
+        try:
+            profiles.append((i, *parse_profile(i)))
+
+        except ValueError as e:
+            parser.error(str(e))
+
+    print("{0:<30}{1:<16}{2:>8}{3:>10}{4:>10}{5:>8}".format("input", "profile", "fps", "size MB", "kbps", "ssim"))
+
+    for path in args.inputs:
+
+        name = os.path.basename(path)[-29:]
+
+        try:
+            duration = get_duration(probe_file(path, args.ffprobe_path))
+
+        except (OSError, ProbeError) as e:
+            print(f"\033[91m{name:<30}{e}\033[0m")
+            continue
+
+        length = min(args.sample, duration) if duration > 0 else args.sample
+
+        # the sample is taken from a third of the way in, the start of a video is often a title or black
+        start = max(0, min(duration / 3, duration - length)) if duration > 0 else 0
+
+        with Workspace() as workspace:
+
+            sample = os.path.join(workspace.dir, "sample.mkv")
+
+            try:
+                cut_sample(path, sample, start, length, args.ffmpeg_path)
+
+            except OSError as e:
+                print(f"\033[91m{name:<30}{e}\033[0m")
+                continue
+
+            for (n, (profile, encoder, preset)) in enumerate(profiles):
+
+                output = os.path.join(workspace.dir, f"encoded-{n}.mkv")
+                tune = args.tune if args.tune in encoder.tunes else None
+
+                try:
+                    (seconds, frames) = encode_sample(sample, output, encoder, preset, tune, args.threads, args.ffmpeg_path)
+
+                except OSError as e:
+                    print(f"\033[91m{name:<30}{profile:<16}{e}\033[0m")
+                    continue
+
+                size = os.path.getsize(output)
+                ssim = None if args.no_ssim else measure_ssim(output, sample, args.ffmpeg_path)
+
+                print("{0:<30}{1:<16}{2:>8.1f}{3:>10.2f}{4:>10.0f}{5:>8}".format(
+                    name, profile, frames / seconds if seconds > 0 else 0, size / 1048576, size * 8 / 1000 / length,
+                    "-" if ssim is None else f"{ssim:.4f}"), flush=True)
+
+
+if __name__ == "__main__":
+    os.system("") # enable color in windows
+    main()
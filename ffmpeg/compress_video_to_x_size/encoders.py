@@ -0,0 +1,205 @@
+
+# The video encoders the compress scripts can use, and how to pass a preset, tune, thread count and two pass log to each
+
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow", "placebo")
+
+
+class Encoder:
+    """
+    How to run one ffmpeg video encoder
+
+        name     : the name used on the command line
+        codec    : the ffmpeg encoder
+        presets  : the accepted presets, fastest first
+        preset   : the default preset
+        tunes    : the accepted tunes
+        two_pass : if the encoder can do a two pass encode through ffmpeg, otherwise pass 2 is the only pass
+        crf      : the constant quality used by the benchmark, about the same quality for every encoder
+        mux_args : extra options for the final mp4 that holds the video
+
+        get_args(bitrate, number, passlog, preset, tune, threads) : the ffmpeg output options for pass number
+    """
+    def __init__(self, name, codec, presets, preset, tunes, *, two_pass = True, crf = 23, mux_args = ()) -> None:
+        self.name = name
+        self.codec = codec
+        self.presets = presets
+        self.preset = preset
+        self.tunes = tunes
+        self.two_pass = two_pass
+        self.crf = crf
+        self.mux_args = list(mux_args)
+
+    def check(self, preset, tune):
+        """Raises ValueError if the preset or tune does not belong to this encoder"""
+
+        if preset is not None and preset not in self.presets:
+            raise ValueError(f"{self.name} has no preset '{preset}', use one of: {', '.join(self.presets)}")
+
+        if tune is not None and tune not in self.tunes:
+            raise ValueError(f"{self.name} has no tune '{tune}', use one of: {', '.join(self.tunes)}")
+
+    def get_rate_args(self, bitrate):
+        """-b:v for a bitrate in kbps, or the constant quality of the benchmark when bitrate is None"""
+
+        if bitrate is None:
+            return ['-crf', str(self.crf)]
+
+        return ['-b:v', str(bitrate) + 'k']
+
+    def get_pass_args(self, number, passlog):
+
+        if not self.two_pass or number is None:
+            return []
+
+        return ['-pass', str(number), '-passlogfile', passlog]
+
+    def get_args(self, bitrate, number = None, passlog = None, preset = None, tune = None, threads = None):
+
+        self.check(preset, tune)
+
+        args = ['-c:v', self.codec, *self.get_rate_args(bitrate), '-preset', preset or self.preset]
+
+        if tune:
+            args.extend(['-tune', tune])
+
+        if threads:
+            args.extend(['-threads', str(threads)])
+
+        return args + self.get_pass_args(number, passlog)
+
+
+class X265Encoder(Encoder):
+    """libx265 ignores -pass and -threads, both go through -x265-params"""
+
+    def get_args(self, bitrate, number = None, passlog = None, preset = None, tune = None, threads = None):
+
+        self.check(preset, tune)
+
+        params = []
+
+        if threads:
+            params.append(f"pools={threads}")
+
+        if self.two_pass and number is not None:
+            params.extend([f"pass={number}", f"stats={passlog}.x265"])
+
+        args = ['-c:v', self.codec, *self.get_rate_args(bitrate), '-preset', preset or self.preset]
+
+        if tune:
+            args.extend(['-tune', tune])
+
+        if params:
+            args.extend(['-x265-params', ":".join(params)])
+
+        return args
+
+
+class VP9Encoder(Encoder):
+    """libvpx-vp9 has no named presets, the preset is -cpu-used (0 slowest to 8 fastest) and the tune is -tune-content"""
+
+    def get_rate_args(self, bitrate):
+
+        # -b:v 0 makes -crf a constant quality, otherwise it is a cap on top of the bitrate
+        if bitrate is None:
+            return ['-crf', str(self.crf), '-b:v', '0']
+
+        return ['-b:v', str(bitrate) + 'k']
+
+    def get_args(self, bitrate, number = None, passlog = None, preset = None, tune = None, threads = None):
+
+        self.check(preset, tune)
+
+        args = ['-c:v', self.codec, *self.get_rate_args(bitrate),
+                '-deadline', 'good', '-cpu-used', preset or self.preset, '-row-mt', '1']
+
+        if tune:
+            args.extend(['-tune-content', tune])
+
+        if threads:
+            args.extend(['-threads', str(threads)])
+
+        return args + self.get_pass_args(number, passlog)
+
+
+class SvtAv1Encoder(Encoder):
+    """libsvtav1 takes a numbered preset (0 slowest to 13 fastest), its tune goes through -svtav1-params"""
+
+    TUNES = {"vq" : 0, "psnr" : 1}
+
+    def get_args(self, bitrate, number = None, passlog = None, preset = None, tune = None, threads = None):
+
+        self.check(preset, tune)
+
+        args = ['-c:v', self.codec, *self.get_rate_args(bitrate), '-preset', preset or self.preset]
+
+        if tune:
+            args.extend(['-svtav1-params', f"tune={self.TUNES[tune]}"])
+
+        if threads:
+            args.extend(['-threads', str(threads)])
+
+        return args + self.get_pass_args(number, passlog)
+
+
+# name -> Encoder
+ENCODERS = {
+    "x264" : Encoder("x264", "libx264", X264_PRESETS, "medium",
+                     ("film", "animation", "grain", "stillimage", "fastdecode", "zerolatency", "psnr", "ssim"), crf = 23),
+
+    "x265" : X265Encoder("x265", "libx265", X264_PRESETS, "medium",
+                         ("grain", "animation", "fastdecode", "zerolatency", "psnr", "ssim"), crf = 28,
+                         # apple players only take hevc in mp4 with the hvc1 tag
+                         mux_args = ['-tag:v', 'hvc1']),
+
+    "vp9" : VP9Encoder("vp9", "libvpx-vp9", tuple(str(i) for i in range(8, -1, -1)), "4",
+                       ("default", "screen", "film"), crf = 33),
+
+    # ffmpeg cannot run svt-av1 in two passes, it does a single pass at the bitrate
+    "av1-svt" : SvtAv1Encoder("av1-svt", "libsvtav1", tuple(str(i) for i in range(13, -1, -1)), "8",
+                              tuple(SvtAv1Encoder.TUNES), two_pass = False, crf = 35),
+}
+
+DEFAULT_ENCODER = "x264"
+
+
+def get_encoder(name):
+    """The Encoder for a name in ENCODERS, raises ValueError for anything else"""
+
+    try:
+        return ENCODERS[name]
+
+    except KeyError:
+        raise ValueError(f"unknown codec '{name}', use one of: {', '.join(ENCODERS)}")
+
+
+def add_encoder_arguments(parser):
+    """Adds the Encoder Options group (--codec, --preset, --tune) to an argparse parser"""
+
+    encoder = parser.add_argument_group("Encoder Options")
+    encoder.add_argument(
+        "-c", "--codec",
+        dest="codec", choices=tuple(ENCODERS), default=DEFAULT_ENCODER,
+        help="The video encoder (default %(default)s)"
+    )
+    encoder.add_argument(
+        "--preset",
+        dest="preset", metavar="PRESET",
+        help="The encoder preset, a name for x264/x265, -cpu-used 0-8 for vp9, 0-13 for av1-svt (default the encoders own)"
+    )
+    encoder.add_argument(
+        "--tune",
+        dest="tune", metavar="TUNE",
+        help="The encoder tune, for example film or animation for x264"
+    )
+
+    return encoder
+
+
+def check_encoder_arguments(parser, args):
+    """Calls parser.error when --preset or --tune does not belong to --codec"""
+
+    try:
+        get_encoder(args.codec).check(args.preset, args.tune)
+
+    except ValueError as e:
+        parser.error(str(e))
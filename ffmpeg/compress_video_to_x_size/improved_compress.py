@@ -1,8 +1,12 @@
 import os
 import subprocess
-import tempfile
 import datetime
 
+from probe import ProbeCache, ProbeError, probe, probe_files, get_duration, get_audio_video, get_audio_channels, DEFAULT_PROBE_CACHE_FILE, DEFAULT_PROBE_JOBS
+from scheduler import run_jobs, print_summary, get_threads_per_job, CPU_COUNT, DEFAULT_JOBS
+from workspace import Workspace
+from encoders import get_encoder, add_encoder_arguments, check_encoder_arguments, DEFAULT_ENCODER
+
 FFPROBE_PATH = os.path.join(os.path.dirname(__file__), "..\\.ffmpeg\\ffprobe.exe")
 FFMPEG_PATH = os.path.join(os.path.dirname(__file__), "..\\.ffmpeg\\ffmpeg.exe")
 
@@ -11,6 +15,32 @@ if (os.name == "nt"):
 else:
     NO_TEMP = "/dev/null"
 
+# path -> ffprobe json, filled up front by main so every file is probed once
+PROBES = {}
+
+# a ProbeCache or None
+PROBE_CACHE = None
+
+# name -> ffmpeg audio encoder, both are a single pass and can be muxed straight into mp4
+AUDIO_CODECS = {
+    "aac"  : "aac",
+    "opus" : "libopus",
+}
+
+# an output within this fraction under the target size is close enough
+DEFAULT_TOLERANCE = 0.05
+
+# how many times pass 2 may run to get within the tolerance of the target size
+DEFAULT_MAX_ATTEMPTS = 3
+
+# videos are only split so each segment is at least this many seconds, the split and join cost about the same on any length
+DEFAULT_MIN_SEGMENT_DURATION = 60
+
+# name -> the highest bitrate per channel the encoder accepts in kbps
+AUDIO_MAX_BITRATE = {
+    "opus" : 256,
+}
+
 
 class FFMPEG_Exception(Exception):
     """raised when ffmpeg has an error"""
@@ -89,42 +119,72 @@ def run_program(args: list):
                          stderr=subprocess.PIPE))
 
 
-def get_audio_video_stream(path: str):
+def run_ffmpeg(args: list):
+    """Runs ffmpeg with the given arguments, raises FFMPEG_Exception when it writes an error"""
 
-    if not os.path.isfile(FFPROBE_PATH):
-        raise OSError(f"could not find ffprobe with path '{FFPROBE_PATH}'")
+    (stdout, stderr) = run_program(args)
 
-    check_file_exists(path)
+    if stderr != b"":
+        raise FFMPEG_Exception(stderr.decode())
 
-    (stdout, stderr) = run_program([FFPROBE_PATH, "-v", "quiet", "-show_entries",
-                                    "stream=codec_type", "-of", "default=nw=1:nk=1", path])
-    return (b"audio" in stdout,
-            b"video" in stdout)
 
+def get_probe(path: str):
+    """The ffprobe json of the file, probed at most once per run (and not at all when it is in PROBE_CACHE)"""
 
+    info = PROBES.get(path)
 
+    if isinstance(info, Exception):
+        raise OSError(f"could not probe '{path}': {info}")
 
-def get_file_duration(path: str):
+    if info is not None:
+        return info
 
     if not os.path.isfile(FFPROBE_PATH):
         raise OSError(f"could not find ffprobe with path '{FFPROBE_PATH}'")
 
     check_file_exists(path)
 
-    (stdout, sdterr) = run_program([FFPROBE_PATH, '-v', 'quiet',
-                               '-show_entries', 'format=duration',
-                               '-of', 'csv=p=0', path])
+    try:
+        info = PROBES[path] = probe(path, FFPROBE_PATH, PROBE_CACHE)
 
-    duration = parse_float(stdout.decode(), -1)
+    except ProbeError as e:
+        raise OSError(f"could not probe '{path}': {e}")
 
-    if duration <= 0:
-        return -1
+    return info
+
+
+def get_audio_video_stream(path: str):
+
+    return get_audio_video(get_probe(path))
+
+
+
+
+def get_file_duration(path: str):
 
-    return duration
+    return get_duration(get_probe(path))
 
 
 
-def compress_file(path: str, target_size_mb: int, video_bitrate_percent: float, new_size: tuple = None):
+def compress_file(path: str, target_size_mb: int, video_bitrate_percent: float, new_size: tuple = None,
+                  threads: int = None, verbose: bool = True, audio_codec: str = "aac", temp_dir: str = None,
+                  tolerance: float = DEFAULT_TOLERANCE, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                  segments: int = 1, min_segment_duration: float = DEFAULT_MIN_SEGMENT_DURATION,
+                  codec: str = DEFAULT_ENCODER, preset: str = None, tune: str = None):
+    """
+    Compresses the file to about target_size_mb, returns (the path of the new file, the attempts of compress_streams)
+
+    pass 2 is run again up to max_attempts times until the output is at most target_size_mb
+    and no more than tolerance (a fraction) under it
+
+    with segments > 1 the video is cut in up to that many parts of at least min_segment_duration seconds,
+    which are encoded at the same time, see compress_streams,
+    codec, preset and tune pick the video encoder, see encoders.ENCODERS
+
+    threads is the -threads given to every ffmpeg process, ffmpeg picks when None,
+    nothing is printed when verbose is False (used when several files are compressed at once),
+    audio_codec is a key of AUDIO_CODECS, temp_dir is where the pass logs go (the system temp directory when None)
+    """
 
     if target_size_mb <= 0:
         raise ValueError(f"you cannot specify a target size <= 0 mb: {target_size_mb}")
@@ -135,8 +195,9 @@ def compress_file(path: str, target_size_mb: int, video_bitrate_percent: float,
 
     (has_audio, has_video) = get_audio_video_stream(path)
 
-    print(f"detected audio stream: {has_audio}")
-    print(f"detected video stream: {has_video}")
+    if verbose:
+        print(f"detected audio stream: {has_audio}")
+        print(f"detected video stream: {has_video}")
 
     if not has_audio and not has_video:
         raise OSError(f"file '{path}' does not contain any video or audio streams")
@@ -166,128 +227,249 @@ def compress_file(path: str, target_size_mb: int, video_bitrate_percent: float,
             video_bitrate = 0
             audio_bitrate = round_to_8x(total_bitrate)
 
-    file_dir = os.path.dirname(path)
+    if audio_codec in AUDIO_MAX_BITRATE:
+        audio_bitrate = min(audio_bitrate, AUDIO_MAX_BITRATE[audio_codec] * get_audio_channels(get_probe(path)))
 
-    temp_dir = os.path.join(file_dir, ".compress_temp_dir")
+    if verbose:
+        print(f"detected duration: {duration}")
+        print(f"target total bitrate : {total_bitrate}")
+        print(f"target video bitrate : {video_bitrate}")
+        print(f"target audio bitrate : {audio_bitrate}")
+        print("compressing...")
 
-    os.makedirs(temp_dir, exist_ok=True)
+    output = get_temp_filename(os.path.dirname(path), os.path.basename(path) + "-", "mp4")
 
-    print(f"detected duration: {duration}")
-    print(f"target total bitrate : {total_bitrate}")
-    print(f"target video bitrate : {video_bitrate}")
-    print(f"target audio bitrate : {audio_bitrate}")
+    attempts = compress_streams(path, output, video_bitrate, audio_bitrate, new_size, threads, audio_codec, temp_dir,
+                                target_size_mb = target_size_mb, tolerance = tolerance, max_attempts = max_attempts,
+                                segments = segments, min_segment_duration = min_segment_duration,
+                                codec = codec, preset = preset, tune = tune)
 
-    audio_path  = get_temp_filename(temp_dir, "audio", "mp3")
-    video_path  = get_temp_filename(temp_dir, "video", "mp4")
-    video_path2 = get_temp_filename(temp_dir, "video", "mp4")
+    if verbose:
+        print_attempts(attempts, target_size_mb)
+        print(output)
 
+    return (output, attempts)
 
-    if has_audio and audio_bitrate > 0:
 
-        print("compressing audio...")
+def print_attempts(attempts: list, target_size_mb: float):
 
-        compress_audio(path, audio_path, audio_bitrate)
+    for (i, (video_bitrate, size)) in enumerate(attempts, 1):
+        print(f"attempt {i}: video {video_bitrate}k -> {size / 1048576:.2f}MB ({size / (target_size_mb * 1048576):.1%} of the target)")
 
-    if has_video and video_bitrate > 0:
 
-        print("compressing video...")
+def get_size_score(size: int, target: int):
+    """Sorts outputs from best to worst, anything under the target beats anything over it, then the closest wins"""
 
-        compress_video(path, video_path, video_bitrate, new_size)
+    return (size > target, abs(target - size))
 
-    output = get_temp_filename(file_dir, os.path.basename(path) + "-", "mp4")
-    combine_to_mp4(audio_path, video_path, output)
 
-    print(output)
+def split_video(path: str, directory: str, count: int, duration: float):
+    """
+    Cuts the first video stream of path into about count parts of the same duration, without re-encoding,
+    each cut is made on the first keyframe after its time so the parts can be encoded on their own,
+    returns the paths of the parts in order
+    """
 
+    times = ",".join(f"{duration * i / count:.3f}" for i in range(1, count))
 
-def combine_to_mp4(audio_path: str, video_path: str, output_path: str):
+    run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                '-i', path, '-map', '0:V:0', '-c', 'copy',
+                '-f', 'segment', '-segment_times', times, '-reset_timestamps', '1',
+                os.path.join(directory, "part-%04d.mkv")])
 
-    audio_exists = os.path.isfile(audio_path)
-    video_exists = os.path.isfile(video_path)
+    return sorted(os.path.join(directory, i) for i in os.listdir(directory) if i.startswith("part-") and i.endswith(".mkv")
+                  and not i.endswith(".encoded.mkv"))
 
-    if not audio_exists and not video_exists:
-        raise OSError(f"both video and audio path do not exist: '{audio_path}', '{video_path}'")
 
-    args = [FFMPEG_PATH, '-v', 'error', "-y"]
+def encode_parts(parts: list, get_video_args, passlog: str, number: int):
+    """
+    Runs pass number (1 or 2) of every part from split_video at the same time, each part has its own pass log,
+    get_video_args(number, passlog) gives the video options, pass 2 writes the parts to part.encoded.mkv,
+    returns those paths in order
+    """
 
-    if audio_exists:
+    def encode(i):
 
-        args.extend(["-i", audio_path])
+        (n, part) = i
 
-    if video_exists:
+        if number == 1:
+            run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                        '-i', part, *get_video_args(1, f"{passlog}-{n}"), '-an', '-f', 'null', NO_TEMP])
+            return None
 
-        args.extend(["-i", video_path])
+        encoded = os.path.splitext(part)[0] + ".encoded.mkv"
 
-    args.extend([
-        "-c", "copy", output_path
-    ])
+        run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                    '-i', part, *get_video_args(2, f"{passlog}-{n}"), '-an', encoded])
 
-    (stdout, stderr) = run_program(args)
+        return encoded
 
-    if stderr != b"":
-        raise FFMPEG_Exception(stderr.decode())
+    (results, _) = run_jobs(enumerate(parts), encode, jobs = len(parts))
 
+    for i in results:
+        if not i.ok:
+            raise i.error
 
+    return [i.value for i in results]
 
-def compress_audio(path: str, output_path: str, audio_bitrate: int):
 
-    check_file_exists(path)
+def concat_parts(parts: list, path: str, audio: list, output: str, threads: list, mux_args: list = ()):
+    """
+    Joins the encoded parts with the concat demuxer, without re-encoding them, and muxes in the audio of path,
+    mux_args are extra output options (from Encoder.mux_args)
+    """
 
-    two_pass_log = os.path.join(tempfile.gettempdir(), "ffmpeg2pass-0.log")
+    list_path = os.path.join(os.path.dirname(parts[0]), "parts.txt")
 
-    (stdout, stderr1) = run_program([FFMPEG_PATH, '-v', 'error', '-y',
-                            '-i', path, '-b:a', str(audio_bitrate) + 'k',
-                            '-pass', '1', "-vn", '-f', 'mp3',
-                            '-passlogfile', two_pass_log, NO_TEMP])
+    with open(list_path, "w", encoding="utf-8") as f:
+        for i in parts:
+            f.write("file '" + i.replace("'", "'\\''") + "'\n")
 
+    run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                '-f', 'concat', '-safe', '0', '-i', list_path, '-i', path,
+                '-map', '0:v:0', '-c:v', 'copy', *mux_args, *audio, *threads, output])
 
-    (stdout, stderr2) = run_program([FFMPEG_PATH, '-v', 'error', '-y',
-                    '-i', path, '-b:a', str(audio_bitrate) + 'k',
-                    '-pass', '2', "-vn", '-f', 'mp3',
-                    '-passlogfile', two_pass_log, str(output_path)])
 
+def compress_streams(path: str, output_path: str, video_bitrate: int, audio_bitrate: int,
+                     resize: tuple = None, threads: int = None, audio_codec: str = "aac", temp_dir: str = None, *,
+                     target_size_mb: float = None, tolerance: float = DEFAULT_TOLERANCE, max_attempts: int = 1,
+                     segments: int = 1, min_segment_duration: float = DEFAULT_MIN_SEGMENT_DURATION,
+                     codec: str = DEFAULT_ENCODER, preset: str = None, tune: str = None):
+    """
+    Encodes the first video and audio stream of path into output_path, a bitrate of 0 drops that stream,
+    returns a list of (video bitrate, output size in bytes) for every run of pass 2
 
-    if stderr1 != b"":
-        raise FFMPEG_Exception(stderr1.decode())
+    the video is encoded with codec (a key of encoders.ENCODERS) with the given preset and tune,
+    an encoder that cannot do two passes skips pass 1
 
-    if stderr2 != b"":
-        raise FFMPEG_Exception(stderr2.decode())
+    the source is decoded twice, pass 1 only analyses the video, and pass 2 encodes the video,
+    encodes the audio once (single pass) and muxes both, so there are no intermediate files or remux
 
+    the pass logs and the output are written in a Workspace (the logs under temp_dir when given),
+    output_path only appears once the encode worked, and nothing is left behind when it does not
 
+    when target_size_mb is given and the output is over it, or more than tolerance under it, only pass 2
+    is run again (reusing the pass 1 log) with the video bitrate moved by the difference,
+    up to max_attempts times, and the output closest to the target without going over is kept
 
-
-def compress_video(path: str, output_path: str, video_bitrate: int, resize: tuple = None):
+    when segments > 1 and the video is long enough, the video is cut at keyframes into up to segments parts
+    of at least min_segment_duration seconds (in the workspace), both passes of every part run at the same time
+    with threads split between them, then the parts are joined and the audio is encoded into the output,
+    every part gets the same bitrate so its share of the size is in proportion to its duration
+    """
 
     check_file_exists(path)
 
-    two_pass_log = os.path.join(tempfile.gettempdir(), "ffmpeg2pass-0.log")
+    if video_bitrate <= 0 and audio_bitrate <= 0:
+        raise ValueError(f"nothing to encode, both the video and audio bitrate are 0: '{path}'")
+
+    duration = get_file_duration(path)
+
+    # only the video is cut, audio only files are encoded in one go
+    if video_bitrate > 0:
+        segments = min(segments, int(duration // max(1, min_segment_duration)))
+    else:
+        segments = 1
+
+    encoder = get_encoder(codec)
+
+    # the parts share the threads of the file
+    video_threads = get_threads_per_job(segments, threads or CPU_COUNT) if segments > 1 else threads
 
-    (stdout, stderr1) = run_program([FFMPEG_PATH, '-v', 'error', '-y',
-                        '-i', path, '-c:v', 'libx264', '-b:v', str(video_bitrate) + 'k',
-                        '-pass', '1', '-an', '-f', 'mp4',
-                        '-passlogfile', two_pass_log, NO_TEMP])
+    threads = ['-threads', str(threads)] if threads else []
 
+    # when the video is in parts the audio is read from the second input of concat_parts
+    if audio_bitrate > 0:
+        audio = ['-map', '1:a:0' if segments > 1 else '0:a:0', '-c:a', AUDIO_CODECS[audio_codec], '-b:a', str(audio_bitrate) + 'k']
+    else:
+        audio = ['-an']
 
-    cmd = [FFMPEG_PATH, '-v', 'error', '-y',
-                        '-i', path, '-c:v', 'libx264', '-b:v', str(video_bitrate) + 'k',
-                        '-pass', '2', '-an',
-                        ]
+    scale = []
 
+    # the scale has to be in both passes, otherwise pass 2 reads stats for the wrong frame size
     if resize is not None:
-        
+
         (width, height) = resize
 
-        cmd.extend(['-filter:v', f"scale={width}:{height}"])
+        scale = ['-filter:v', f"scale={width}:{height}"]
+
+    # 0:V skips cover art, which ffprobe does not count as video either, the bitrate is the current video_bitrate
+    def get_video_args(number, passlog):
+
+        return ['-map', '0:V:0', *scale, *encoder.get_args(video_bitrate, number, passlog, preset, tune, video_threads)]
+
+    with Workspace(temp_dir) as workspace:
+
+        output = workspace.output(output_path)
+
+        if video_bitrate <= 0:
+
+            run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                        '-i', path, '-vn', *audio, *threads, output])
+
+            workspace.finish(output, output_path)
+
+            return [(0, os.path.getsize(output_path))]
+
+        if segments > 1:
+            parts = split_video(path, workspace.dir, segments, duration)
+
+            if encoder.two_pass:
+                encode_parts(parts, get_video_args, workspace.passlog, 1)
 
-    cmd.extend(['-passlogfile', two_pass_log, str(output_path)])
+        elif encoder.two_pass:
+            run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                        '-i', path, *get_video_args(1, workspace.passlog), '-an', '-f', 'null', NO_TEMP])
 
-    (stdout, stderr2) = run_program(cmd)
+        if target_size_mb:
+            target = target_size_mb * 1048576
 
-    if stderr1 != b"":
-        raise FFMPEG_Exception(stderr1.decode())
+        attempts = []
+        best = None
 
-    if stderr2 != b"":
-        raise FFMPEG_Exception(stderr2.decode())
+        for _ in range(max(1, max_attempts)):
+
+            if segments > 1:
+                concat_parts(encode_parts(parts, get_video_args, workspace.passlog, 2), path, audio, output, threads,
+                             encoder.mux_args)
+
+            else:
+                run_ffmpeg([FFMPEG_PATH, '-v', 'error', '-y',
+                            '-i', path, *get_video_args(2, workspace.passlog), *encoder.mux_args, *audio, output])
+
+            size = os.path.getsize(output)
+            attempts.append((video_bitrate, size))
+
+            if not target_size_mb:
+                best = output
+                break
+
+            if best is None or get_size_score(size, target) < get_size_score(os.path.getsize(best), target):
+
+                if best is not None:
+                    workspace.remove(best)
+
+                best = output
+
+            else:
+                workspace.remove(output)
+
+            if target * (1 - tolerance) <= size <= target:
+                break
+
+            # ffmpeg bitrates are in 1000 bits, the difference is spread over the whole duration
+            bitrate = round_to_8x(video_bitrate + (target - size) * 8 / 1000 / duration)
+
+            if bitrate <= 0 or bitrate == video_bitrate:
+                break
+
+            video_bitrate = bitrate
+
+            output = workspace.output(output_path)
+
+        workspace.finish(best, output_path)
+
+        return attempts
 
 
 def run_guided():
@@ -402,6 +584,31 @@ def main():
         dest="guided", action="store_true",
         help="Run a simple guided wizard"
     )
+    general.add_argument(
+        "-a", "--audio-codec",
+        dest="audio_codec", choices=tuple(AUDIO_CODECS), default="aac",
+        help="The audio codec, encoded in a single pass (default %(default)s)"
+    )
+    general.add_argument(
+        "--tolerance",
+        dest="tolerance", metavar="PERCENT", type=float, default=DEFAULT_TOLERANCE * 100,
+        help="How far under the target size an output may be before pass 2 runs again (default %(default)s)"
+    )
+    general.add_argument(
+        "--max-attempts",
+        dest="max_attempts", metavar="N", type=int, default=DEFAULT_MAX_ATTEMPTS,
+        help="The most times pass 2 runs to hit the target size, 1 runs it once like before (default %(default)s)"
+    )
+    general.add_argument(
+        "--segments",
+        dest="segments", metavar="N", type=int, default=1,
+        help="Cut long videos at keyframes into up to N parts that are encoded at the same time (default %(default)s, no cutting)"
+    )
+    general.add_argument(
+        "--min-segment-duration",
+        dest="min_segment_duration", metavar="SECONDS", type=float, default=DEFAULT_MIN_SEGMENT_DURATION,
+        help="Shortest part --segments will make, shorter videos get fewer parts (default %(default)s)"
+    )
     general.add_argument(
         "-fp", "--ffmpeg",
         dest="ffmpeg_path", metavar="PATH",
@@ -413,6 +620,42 @@ def main():
         help="Specify the path to ffprobe"
     )
 
+    add_encoder_arguments(parser)
+
+    probe_ops = parser.add_argument_group("Probe Options")
+    probe_ops.add_argument(
+        "--probe-jobs",
+        dest="probe_jobs", metavar="N", type=int, default=DEFAULT_PROBE_JOBS,
+        help="Number of ffprobe processes run at once while reading the inputs (default %(default)s)"
+    )
+    probe_ops.add_argument(
+        "--probe-cache",
+        dest="probe_cache", metavar="FILE", default=DEFAULT_PROBE_CACHE_FILE,
+        help="Where ffprobe results are cached by path, size and date modified (default %(default)s)"
+    )
+    probe_ops.add_argument(
+        "--no-probe-cache",
+        dest="no_probe_cache", action="store_true",
+        help="Do not read or write the probe cache"
+    )
+
+    parallel = parser.add_argument_group("Parallel Options")
+    parallel.add_argument(
+        "-j", "--jobs",
+        dest="jobs", metavar="N", type=int, default=DEFAULT_JOBS,
+        help="Number of files compressed at once (default %(default)s)"
+    )
+    parallel.add_argument(
+        "--threads",
+        dest="threads", metavar="N", type=int,
+        help="The -threads given to each ffmpeg process (default the cpu count divided by the jobs)"
+    )
+    parallel.add_argument(
+        "--temp-dir",
+        dest="temp_dir", metavar="DIRECTORY",
+        help="Where each job keeps its two pass logs, removed when the job ends (default the system temp directory)"
+    )
+
     args = parser.parse_args()
 
     if args.guided:
@@ -422,6 +665,8 @@ def main():
     if not args.inputs:
         parser.error("Input file(s) are required, use -i <path> to specify")
 
+    check_encoder_arguments(parser, args)
+
     if args.ffprobe_path:
         FFPROBE_PATH = args.ffprobe_path
 
@@ -449,19 +694,56 @@ def main():
     target = parse_float(args.target, 8)
     percent = parse_float(args.percent, 0.8)
 
+    cache = None if args.no_probe_cache else ProbeCache(args.probe_cache)
+
+    # every input is probed at once before the first encode starts
+    try:
+        PROBES.update(probe_files([i for i in args.inputs if os.path.isfile(i)], FFPROBE_PATH,
+                                  jobs = args.probe_jobs, cache = cache))
+
+    finally:
+        if cache:
+            cache.close()
+
+    jobs = max(1, args.jobs)
+    threads = args.threads or get_threads_per_job(jobs)
+
+    inputs = []
+
     for i in args.inputs:
 
         if not os.path.isfile(i):
             print(f'File "{i} does not exist, skipping..."')
             continue
 
+        inputs.append(i)
 
-        try:
+    def compress(i):
+
+        if jobs == 1:
             print(f"Compressing: {i}:")
-            compress_file(i, target, percent, new_size)
 
-        except Exception as e:
-            print(e)
+        return compress_file(i, target, percent, new_size, threads, verbose = jobs == 1, audio_codec = args.audio_codec,
+                             temp_dir = args.temp_dir, tolerance = args.tolerance / 100, max_attempts = args.max_attempts,
+                             segments = args.segments, min_segment_duration = args.min_segment_duration,
+                             codec = args.codec, preset = args.preset, tune = args.tune)
+
+    # runs on the main thread as each file finishes
+    def finished(result):
+
+        if not result.ok:
+            print(f"{result.item}: {result.error}")
+
+        elif jobs > 1:
+            (output, attempts) = result.value
+
+            print(f"{result.item} -> {output} ({result.seconds:.1f}s, {len(attempts)} attempts, {attempts[-1][1] / 1048576:.2f}MB last)")
+
+    print(f"compressing {len(inputs)} files, {jobs} at once with {threads} threads each")
+
+    (results, wall) = run_jobs(inputs, compress, jobs = jobs, on_done = finished)
+
+    print_summary(results, wall)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import os
+import json
+import threading
+import subprocess
+
+from subprocess import PIPE
+
+
+DEFAULT_PROBE_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "py-scripts", "ffprobe_cache.db")
+
+# ffprobe mostly waits on the disk, so more threads than cores is fine
+DEFAULT_PROBE_JOBS = min(32, (os.cpu_count() or 1) * 2)
+
+
+class ProbeError(Exception):
+    """raised when ffprobe cannot read a file"""
+
+
+def probe_file(path, ffprobe):
+    """Runs ffprobe once for the streams and format of a file, returns the parsed json"""
+
+    p = subprocess.run([ffprobe, '-v', 'error', '-print_format', 'json',
+                        '-show_entries', 'format=duration,size,bit_rate:stream=index,codec_type,codec_name,width,height,channels,duration,bit_rate',
+                        path], shell=False, stdout=PIPE, stderr=PIPE)
+
+    if p.returncode != 0:
+        raise ProbeError(p.stderr.decode().strip() or f"ffprobe failed on '{path}'")
+
+    return json.loads(p.stdout.decode() or "{}")
+
+
+def get_duration(info):
+    """The duration in seconds from the format, or the longest stream, -1 when there is none"""
+
+    try:
+        duration = float(info.get("format", {}).get("duration", 0))
+
+    except (TypeError, ValueError):
+        duration = 0
+
+    if duration <= 0:
+        for stream in info.get("streams", ()):
+            try:
+                duration = max(duration, float(stream.get("duration", 0)))
+
+            except (TypeError, ValueError):
+                pass
+
+    return duration if duration > 0 else -1
+
+
+def get_audio_video(info):
+    """(has audio, has video) from the streams of a probe, cover art does not count as video"""
+
+    types = [i.get("codec_type") for i in info.get("streams", ()) if i.get("codec_name") not in ("mjpeg", "png")]
+
+    return ("audio" in types, "video" in types)
+
+
+def get_video_size(info):
+    """(width, height) of the first video stream, or None"""
+
+    for stream in info.get("streams", ()):
+        if stream.get("codec_type") == "video" and stream.get("width"):
+            return (stream["width"], stream["height"])
+
+    return None
+
+
+def get_audio_channels(info, default = 2):
+    """The channel count of the first audio stream, default when unknown"""
+
+    for stream in info.get("streams", ()):
+        if stream.get("codec_type") == "audio" and stream.get("channels"):
+            return stream["channels"]
+
+    return default
+
+
+class ProbeCache:
+    """
+    A persistent (path, size, mtime) -> ffprobe json cache stored in sqlite,
+    a file whose size or mtime changed is simply a cache miss
+
+        get(path)       : the cached probe of the file or None
+        put(path, info) : stores the probe of the file
+        close()         : commit and close the database
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS probe (
+        path  TEXT PRIMARY KEY,
+        size  INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        data  TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path = DEFAULT_PROBE_CACHE_FILE) -> None:
+
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # files are probed from a thread pool
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, path):
+
+        st = os.stat(path)
+
+        with self.lock:
+            row = self.db.execute("SELECT data FROM probe WHERE path = ? AND size = ? AND mtime = ?",
+                                  (os.path.abspath(path), st.st_size, st.st_mtime_ns)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def put(self, path, info):
+
+        st = os.stat(path)
+
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?)",
+                            (os.path.abspath(path), st.st_size, st.st_mtime_ns, json.dumps(info)))
+
+    def close(self):
+
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def probe(path, ffprobe, cache = None):
+    """probe_file through the cache when one is given"""
+
+    info = cache.get(path) if cache else None
+
+    if info is None:
+        info = probe_file(path, ffprobe)
+
+        if cache:
+            cache.put(path, info)
+
+    return info
+
+
+def probe_files(paths, ffprobe, *, jobs = DEFAULT_PROBE_JOBS, cache = None):
+    """
+    Probes every file up front on a thread pool, returns a dict of path -> probe json,
+    or the exception for the files that could not be probed
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    paths = list(dict.fromkeys(paths))
+
+    def worker(path):
+        try:
+            return probe(path, ffprobe, cache)
+
+        except (OSError, ProbeError, ValueError) as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(paths)))) as pool:
+        return dict(zip(paths, pool.map(worker, paths)))
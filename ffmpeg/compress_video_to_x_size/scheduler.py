@@ -0,0 +1,96 @@
+import os
+import time
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+# libx264 stops scaling well past about 8 threads for a single encode (and pass 1 uses fewer),
+# so on big machines it is faster to run several encodes with a slice of the cores each
+THREADS_PER_JOB = 8
+
+DEFAULT_JOBS = max(1, CPU_COUNT // THREADS_PER_JOB)
+
+
+def get_threads_per_job(jobs, cpus = CPU_COUNT):
+    """The -threads budget of each ffmpeg process when jobs encodes share the cpus"""
+
+    return max(1, cpus // max(1, jobs))
+
+
+class JobResult:
+    """
+    The outcome of one job from run_jobs
+
+        item    : the item given to the worker
+        value   : what the worker returned, None when it raised
+        error   : the exception the worker raised, or None
+        seconds : how long the worker took
+    """
+    __slots__ = ("item", "value", "error", "seconds")
+
+    def __init__(self, item, value, error, seconds) -> None:
+        self.item = item
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def run_jobs(items, worker, *, jobs = DEFAULT_JOBS, on_done = None):
+    """
+    Runs worker(item) for every item with up to jobs running at once,
+    threads are used since a worker spends its time waiting on ffmpeg
+
+    on_done(result) is called from the calling thread as each job finishes, so it can print freely
+
+    returns (a JobResult for every item in the given order, wall seconds)
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    def timed(item):
+
+        start = time.perf_counter()
+
+        try:
+            return JobResult(item, worker(item), None, time.perf_counter() - start)
+
+        except Exception as e:
+            return JobResult(item, None, e, time.perf_counter() - start)
+
+    items = list(items)
+    start = time.perf_counter()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(jobs, len(items))))
+
+    try:
+        futures = [pool.submit(timed, i) for i in items]
+
+        for future in as_completed(futures):
+            if on_done:
+                on_done(future.result())
+
+    except KeyboardInterrupt:
+        # jobs that have not started are dropped, the running ffmpeg processes get the interrupt too
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+
+    pool.shutdown(wait=True)
+
+    return ([i.result() for i in futures], time.perf_counter() - start)
+
+
+def print_summary(results, wall):
+    """Prints how many jobs failed and the wall time against the sum of the per job times"""
+
+    total = sum(i.seconds for i in results)
+    failed = sum(1 for i in results if not i.ok)
+
+    print(f"files        : {len(results)} ({failed} failed)")
+    print(f"wall time    : {wall:.1f}s")
+    print(f"sum of files : {total:.1f}s")
+
+    if wall > 0:
+        print(f"speedup      : {total / wall:.2f}x")
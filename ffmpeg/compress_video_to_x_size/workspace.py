@@ -0,0 +1,101 @@
+import os
+import shutil
+import atexit
+import tempfile
+import threading
+
+
+# every Workspace not cleaned up yet, so a run that dies between jobs still leaves nothing behind
+_LIVE = set()
+_LIVE_LOCK = threading.Lock()
+
+
+class Workspace:
+    """
+    The temp files of a single encode, used as a context manager so everything
+    is removed when the job ends, whether it finished, failed or was interrupted
+
+    the two pass logs go in a private directory (under temp_dir, or the system temp),
+    temp outputs are made next to where they end up so finishing them is a rename,
+    and a half written output is never left under the real name
+
+        passlog            : the -passlogfile prefix of the job
+        output(path)       : a temp path in the directory of path to encode into
+        finish(temp, path) : moves a finished temp output to path
+        remove(temp)       : deletes a temp output that is not wanted anymore
+        cleanup()          : deletes the pass logs and any unfinished temp outputs
+    """
+    def __init__(self, temp_dir = None) -> None:
+
+        if temp_dir:
+            os.makedirs(temp_dir, exist_ok=True)
+
+        self.dir = tempfile.mkdtemp(prefix="compress-", dir=temp_dir)
+        self.passlog = os.path.join(self.dir, "ffmpeg2pass")
+        self.outputs = set()
+
+        with _LIVE_LOCK:
+            _LIVE.add(self)
+
+    def output(self, path):
+
+        (root, ext) = os.path.splitext(os.path.basename(path))
+        directory = os.path.dirname(os.path.abspath(path))
+
+        # not mkstemp, its files are 0600 and ffmpeg keeps the mode when it writes over them
+        while True:
+
+            temp = os.path.join(directory, f".{root}-{os.urandom(4).hex()}.tmp{ext}")
+
+            try:
+                os.close(os.open(temp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+                break
+
+            except FileExistsError:
+                continue
+
+        self.outputs.add(temp)
+
+        return temp
+
+    def finish(self, temp, path):
+
+        os.replace(temp, path)
+
+        self.outputs.discard(temp)
+
+    def remove(self, temp):
+
+        try:
+            os.unlink(temp)
+
+        except FileNotFoundError:
+            pass
+
+        self.outputs.discard(temp)
+
+    def cleanup(self):
+
+        for i in list(self.outputs):
+            self.remove(i)
+
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+        with _LIVE_LOCK:
+            _LIVE.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.cleanup()
+
+
+@atexit.register
+def _cleanup_all():
+
+    with _LIVE_LOCK:
+        live = list(_LIVE)
+
+    for i in live:
+        i.cleanup()
@@ -1,7 +1,11 @@
 import os
 import sys
 import json
-from re import compile
+
+# modules shared by the scripts in this repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "shared"))
+
+from natural_sort import natural_sort_key
 
 METADATA_FILE = ".json"
 
@@ -10,10 +14,6 @@ SUB_INDEX_HTML = ".html"
 
 ASSETS_FOLDER = ".\\assets"
 
-def natural_sort_key(s, _nsre=compile('([0-9]+)')):
-    return [int(text) if text.isdigit() else text.lower()
-            for text in _nsre.split(s)]
-
 def serialize_unique(lst : list):
     dictionary = {}
     parody = []
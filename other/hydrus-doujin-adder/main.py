@@ -1,9 +1,14 @@
 from pprint import pprint
 import requests
 import os 
+import sys
 import json 
 import hydrus_api
-from re import compile
+
+# modules shared by the scripts in this repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "shared"))
+
+from natural_sort import natural_sort_key
 
 try:
     import image_size_reader as isr 
@@ -27,11 +32,6 @@ DEFAULT_API_URL = "http://127.0.0.1:45869/"
 CLIENT = hydrus_api.Client(API_KEY, DEFAULT_API_URL)
 
 
-def natural_sort_key(s, _nsre=compile('([0-9]+)')):
-    return [int(text) if text.isdigit() else text.lower()
-            for text in _nsre.split(s)]
-
-
 def list_services():
 
     s = CLIENT.get_services()
@@ -0,0 +1,254 @@
+
+# Benchmarks the rename pipeline of main.py on generated directory trees
+#
+#   python benchmark.py                        (10k files, every tree shape and template)
+#   python benchmark.py -n 10000 -n 100000     (pick the sizes)
+#   python benchmark.py --case counter --tree flat
+#   python benchmark.py --journal text --journal sqlite --journal none
+#
+# trees are generated in /dev/shm when it exists so the disk is not what is measured,
+# every case runs in its own python process so the peak memory is only of that case
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+import main as renamer
+
+
+# name -> (format, replace)
+CASES = {
+    "counter" : ("$[1:99999999].$[EXT]", None),
+    "date"    : ("$[FDM]-$[1:99999999].$[EXT]", None),
+    "random"  : ("$[RND:0:999999999]-$[1:99999999].$[EXT]", None),
+    "replace" : (None, "file:renamed"),
+}
+
+TREES = ("flat", "deep", "unicode")
+
+# the journal written while renaming, text is the default .rn file (and .rnwal) of a normal run, none is --no-file
+JOURNALS = ("text", "sqlite", "none")
+
+DEFAULT_SIZES = (10_000,)
+
+# files per directory in the deep tree, and how many sub directories each directory has
+DEEP_FILES_PER_DIR = 100
+DEEP_FANOUT = 4
+
+
+def get_bench_root():
+    """A temporary directory, on tmpfs when possible"""
+
+    if os.path.isdir("/dev/shm"):
+        return tempfile.mkdtemp(prefix="rename-bench-", dir="/dev/shm")
+
+    return tempfile.mkdtemp(prefix="rename-bench-")
+
+
+def touch(path):
+    with open(path, "wb"):
+        pass
+
+
+def make_flat_tree(root, count, name = "file_{0}.jpg"):
+
+    for i in range(count):
+        touch(os.path.join(root, name.format(i)))
+
+
+def make_deep_tree(root, count):
+    """Spreads the files over a tree of directories, DEEP_FILES_PER_DIR in each, DEEP_FANOUT sub directories per directory"""
+
+    queue = [root]
+    made = 0
+
+    while made < count:
+
+        dir = queue.pop(0)
+
+        for i in range(min(DEEP_FILES_PER_DIR, count - made)):
+            touch(os.path.join(dir, f"file_{made}.jpg"))
+            made += 1
+
+        for i in range(DEEP_FANOUT):
+            sub = os.path.join(dir, f"dir_{i}")
+            os.mkdir(sub)
+            queue.append(sub)
+
+
+def make_tree(root, tree, count):
+
+    if tree == "flat":
+        make_flat_tree(root, count)
+
+    elif tree == "unicode":
+        make_flat_tree(root, count, "ファイル_file_{0}_é_ß_😀.jpg")
+
+    elif tree == "deep":
+        make_deep_tree(root, count)
+
+    else:
+        raise ValueError(f"unknown tree '{tree}', expected one of {TREES}")
+
+
+def get_peak_memory_mb():
+    """The peak resident memory of this process in MB, or -1 where the resource module is missing (windows)"""
+
+    try:
+        import resource
+
+    except ImportError:
+        return -1
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports KB, macos reports bytes
+    if sys.platform == "darwin":
+        return peak / (1 << 20)
+
+    return peak / (1 << 10)
+
+
+def run_case(root, case, journal):
+    """Runs main() over the tree at root with the given case and journal, prints the result as json"""
+
+    (format, replace) = CASES[case]
+
+    args = ["-i", root, "--recursive", "--quiet", "--stats"]
+
+    if journal == "none":
+        args.append("--no-file")
+
+    else:
+        args.extend(["--journal", journal])
+
+    if format:
+        args.extend(["-f", format])
+
+    if replace:
+        args.extend(["-r", replace])
+
+    with open(os.devnull, "w") as devnull:
+
+        stdout = sys.stdout
+        sys.stdout = devnull
+
+        try:
+            start = time.perf_counter()
+            (renamed, stats) = renamer.main(args)
+            elapsed = time.perf_counter() - start
+
+        finally:
+            sys.stdout = stdout
+
+    print(json.dumps({
+        "renamed" : renamed,
+        "seconds" : elapsed,
+        "syscalls" : stats.total(),
+        "calls" : stats.counts,
+        "peak_mb" : get_peak_memory_mb(),
+    }))
+
+
+def bench(tree, count, case, journal):
+    """Generates a tree, runs a case on it in a new process and returns the result"""
+
+    root = get_bench_root()
+
+    try:
+        make_tree(root, tree, count)
+
+        p = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", root, case, journal],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        if p.returncode != 0:
+            raise RuntimeError(p.stderr.decode())
+
+        return json.loads(p.stdout.decode().strip().splitlines()[-1])
+
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def get_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]...",
+        add_help=False,
+    )
+
+    general = parser.add_argument_group("General Options")
+    general.add_argument(
+        "-h", "--help",
+        action="help",
+        help="Print this help message and exit",
+    )
+
+    bench_ops = parser.add_argument_group("Benchmark Options")
+    bench_ops.add_argument(
+        "-n", "--files",
+        dest="sizes", metavar="N", type=int, action="append",
+        help="Number of files to generate, multiple -n can be specified (default 10000)"
+    )
+    bench_ops.add_argument(
+        "-t", "--tree",
+        dest="trees", choices=TREES, action="append",
+        help="Tree shape to benchmark, multiple -t can be specified (default all)"
+    )
+    bench_ops.add_argument(
+        "-c", "--case",
+        dest="cases", choices=tuple(CASES), action="append",
+        help="Template feature to benchmark, multiple -c can be specified (default all)"
+    )
+    bench_ops.add_argument(
+        "-j", "--journal",
+        dest="journals", choices=JOURNALS, action="append",
+        help="Journal written while renaming, multiple -j can be specified (default text, the .rn and .rnwal of a normal run)"
+    )
+    bench_ops.add_argument(
+        "--run",
+        dest="run", nargs=3, metavar=("ROOT", "CASE", "JOURNAL"),
+        help=argparse.SUPPRESS
+    )
+
+    return parser
+
+
+def main(_args = None):
+
+    parser = get_parser()
+    args = parser.parse_args(_args)
+
+    if args.run:
+        run_case(*args.run)
+        return
+
+    sizes = args.sizes or DEFAULT_SIZES
+    trees = args.trees or TREES
+    cases = args.cases or tuple(CASES)
+    journals = args.journals or ("text",)
+
+    print("{0:<9}{1:>9}  {2:<9}{3:<9}{4:>12}{5:>10}{6:>12}{7:>10}".format(
+        "tree", "files", "case", "journal", "files/s", "seconds", "calls/file", "peak MB"))
+
+    for count in sizes:
+        for tree in trees:
+            for case in cases:
+                for journal in journals:
+
+                    r = bench(tree, count, case, journal)
+
+                    rate = r["renamed"] / r["seconds"] if r["seconds"] > 0 else 0
+                    per_file = r["syscalls"] / r["renamed"] if r["renamed"] else 0
+
+                    print("{0:<9}{1:>9}  {2:<9}{3:<9}{4:>12.0f}{5:>10.2f}{6:>12.2f}{7:>10.1f}".format(
+                        tree, count, case, journal, rate, r["seconds"], per_file, r["peak_mb"]), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,23 @@
 import os
-import random 
-from re import compile, match
+import sys
+import time
+import errno
+import json
+import threading
+from re import compile, escape, IGNORECASE, error as re_error
+from fnmatch import translate
 from datetime import datetime
 
+# modules shared by the scripts in this repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "shared"))
+
+from natural_sort import natural_sort_key
+from rename_template import compile_template
+
 WINDOWS = (os.name == "nt")
 
-# super long ugly multi-line message, so just putting it here as bytes to be decoded on run
-DATE_FORMAT_HELP_MESSAGE = b"\nCode  Example     Description\n%a    Sun         Weekday as locale's abbreviated name.\n%A    Sunday      Weekday as locale's full name.\n%w    0           Weekday as a decimal number, where 0 is Sunday and 6 is Saturday.\n%d    08          Day of the month as a zero-padded decimal number.\n%-d   8           Day of the month as a decimal number. (Platform specific)\n%b    Sep         Month as locale's abbreviated name.\n%B    September   Month as locale's full name.\n%m    09          Month as a zero-padded decimal number.\n%-m   9           Month as a decimal number. (Platform specific)\n%y    13          Year without century as a zero-padded decimal number.\n%Y    2013        Year with century as a decimal number.\n%H    07          Hour (24-hour clock) as a zero-padded decimal number.\n%-H   7           Hour (24-hour clock) as a decimal number. (Platform specific)\n%I    07          Hour (12-hour clock) as a zero-padded decimal number.\n%-I   7           Hour (12-hour clock) as a decimal number. (Platform specific)\n%p    AM          Locale's equivalent of either AM or PM.\n%M    06          Minute as a zero-padded decimal number.\n%-M   6           Minute as a decimal number. (Platform specific)\n%S    05          Second as a zero-padded decimal number.\n%-S   5           Second as a decimal number. (Platform specific)\n%f    000000      Microsecond as a decimal number, zero-padded on the left.\n%z    +0000       UTC offset in the form \xc2\xb1HHMM[SS[.ffffff]] (empty string if the object is naive).\n%Z    UTC         Time zone name (empty string if the object is naive).\n%j    251         Day of the year as a zero-padded decimal number.\n%-j   251         Day of the year as a decimal number. (Platform specific)\n%x    09/08/13    Locale's appropriate date representation.\n%X    07:06:05    Locale's appropriate time representation.\n%%    %           A literal '%' character.\n\n%U    36          Week number of the year (Sunday as the first day of the week) as a zero padded decimal number.\n                  All days in a new year preceding the first Sunday are considered to be in week 0.\n\n%W    35          Week number of the year (Monday as the first day of the week) as a decimal number.\n                  All days in a new year preceding the first Monday are considered to be in week 0.\n\n%c    Sun Sep 8 07:06:05 2013       Locale's appropriate date and time representation.".decode()
+# super long ugly multi-line message, so just putting it here as bytes to be decoded when printed
+DATE_FORMAT_HELP_MESSAGE = b"\nCode  Example     Description\n%a    Sun         Weekday as locale's abbreviated name.\n%A    Sunday      Weekday as locale's full name.\n%w    0           Weekday as a decimal number, where 0 is Sunday and 6 is Saturday.\n%d    08          Day of the month as a zero-padded decimal number.\n%-d   8           Day of the month as a decimal number. (Platform specific)\n%b    Sep         Month as locale's abbreviated name.\n%B    September   Month as locale's full name.\n%m    09          Month as a zero-padded decimal number.\n%-m   9           Month as a decimal number. (Platform specific)\n%y    13          Year without century as a zero-padded decimal number.\n%Y    2013        Year with century as a decimal number.\n%H    07          Hour (24-hour clock) as a zero-padded decimal number.\n%-H   7           Hour (24-hour clock) as a decimal number. (Platform specific)\n%I    07          Hour (12-hour clock) as a zero-padded decimal number.\n%-I   7           Hour (12-hour clock) as a decimal number. (Platform specific)\n%p    AM          Locale's equivalent of either AM or PM.\n%M    06          Minute as a zero-padded decimal number.\n%-M   6           Minute as a decimal number. (Platform specific)\n%S    05          Second as a zero-padded decimal number.\n%-S   5           Second as a decimal number. (Platform specific)\n%f    000000      Microsecond as a decimal number, zero-padded on the left.\n%z    +0000       UTC offset in the form \xc2\xb1HHMM[SS[.ffffff]] (empty string if the object is naive).\n%Z    UTC         Time zone name (empty string if the object is naive).\n%j    251         Day of the year as a zero-padded decimal number.\n%-j   251         Day of the year as a decimal number. (Platform specific)\n%x    09/08/13    Locale's appropriate date representation.\n%X    07:06:05    Locale's appropriate time representation.\n%%    %           A literal '%' character.\n\n%U    36          Week number of the year (Sunday as the first day of the week) as a zero padded decimal number.\n                  All days in a new year preceding the first Sunday are considered to be in week 0.\n\n%W    35          Week number of the year (Monday as the first day of the week) as a decimal number.\n                  All days in a new year preceding the first Monday are considered to be in week 0.\n\n%c    Sun Sep 8 07:06:05 2013       Locale's appropriate date and time representation."
 
 # supported formats
 FORMAT_HELP_MESSAGE = """
@@ -19,12 +30,59 @@ $[FDM]          : the file date modified
 $[FDC]          : the file date created
 $[CD]           : the current date
 $[CD:%Y-%m-%d]  : specify a custom date format -> run --date-formats to see all of them
+$[SIZE]         : the file size in bytes
+$[SHA1]         : the sha1 of the file content, also $[SHA256] / $[MD5] / $[XXH] (needs the xxhash module)
+$[SHA1:8]       : only the first 8 characters of the hash
+$[WIDTH]        : the width of an image / video, also $[HEIGHT] (jpeg / png / gif / webp / mp4 / mov)
+$[DURATION]     : the length of a video in seconds
+$[EXIF:DateTimeOriginal]     : an exif tag of a jpeg, ex: Make / Model / FNumber / ISOSpeedRatings
+$[EXIF:DateTimeOriginal:%Y]  : specify a custom date format for exif dates
 """
 
 DEFAULT_SEP = "|"
 
 DEFAULT_RN_FILE = ".rn"
 
+# the journal used with --journal sqlite, indexed by batch so a single run can be undone
+DEFAULT_RN_DB_FILE = ".rndb"
+
+# the plan of the renames in progress, only left behind when a run is killed, see WriteAheadLog
+DEFAULT_RN_WAL_FILE = ".rnwal"
+
+# files written by the renamer that are never renamed themselves
+JOURNAL_FILES = {
+    DEFAULT_RN_FILE,
+    DEFAULT_RN_DB_FILE,
+    DEFAULT_RN_DB_FILE + "-journal",
+    DEFAULT_RN_DB_FILE + "-wal",
+    DEFAULT_RN_DB_FILE + "-shm",
+    DEFAULT_RN_WAL_FILE,
+    DEFAULT_RN_WAL_FILE + ".tmp",
+}
+
+# what is done with the renames of a killed run
+#   forward : finish them
+#   back    : undo the ones that were done
+RECOVER_MODES = ("forward", "back")
+
+JOURNAL_FORMATS = ("text", "sqlite")
+
+# the .rn file is written in chunks of about this many bytes
+LOG_CHUNK_SIZE = 1 << 18
+
+# when the .rn file is fsync'd
+#   never : leave it to the os
+#   batch : after every chunk written and on close
+#   every : after every entry
+FSYNC_POLICIES = ("never", "batch", "every")
+
+# how the renames are shown in the console
+#   normal   : a line per file
+#   quiet    : only errors
+#   progress : a single progress bar line per directory, and errors
+#   silent   : nothing, errors are only kept in Renamer.errors (used by RenameJob)
+OUTPUT_MODES = ("normal", "quiet", "progress", "silent")
+
 RESTRICT_MAP = {
         "auto" : "\\\\|/<>:\"?*" if WINDOWS else "/",
         "unix" : "/",
@@ -49,12 +107,6 @@ UNDERLINE ="\033[4m"
 
 
 
-def natural_sort_key(s, _nsre=compile('([0-9]+)')):
-    return [int(text) if text.isdigit() else text.lower()
-            for text in _nsre.split(s)]
-
-
-
 def get_sep(string, *, throw_error = False, error = ""):
     """Get the separator character from a string -> sep=|"""
     _ = string.find("=")
@@ -69,556 +121,2460 @@ def get_sep(string, *, throw_error = False, error = ""):
 
 
 
-def handle_undo(file : list):
-    """Reads a list of [.rn] files and renames all existing files back to before being renamed for each file"""
-    cwd = os.getcwd()
+class SyscallCounter:
+    """
+    Counts the filesystem calls issued by the rename pipeline, shown with --stats
 
-    for f in file:
+        add(name, amount)  : count a call of the given name (scandir, stat, rename, write, fsync, unlink, commit)
+        add_file()         : count a file that went through the pipeline
+        summary()          : a printable summary with the calls per file
+    """
+    def __init__(self) -> None:
+        self.counts = {}
+        self.files = 0
+        self.lock = threading.Lock()
 
-        if not os.path.exists(f):
-            continue
+    def add(self, name, amount = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
 
-        if os.path.isdir(f):
-            try:
-                dir  = os.path.abspath(f) 
-                os.chdir(dir)
-                paths = filter(lambda x : x.endswith(".rn"), os.listdir()) # grab any .rn files 
+    def add_file(self):
+        with self.lock:
+            self.files += 1
 
-            finally:
-                os.chdir(cwd)
+    def total(self):
+        return sum(self.counts.values())
 
-        if os.path.isfile(f):
-            dir  = os.path.dirname(f) 
-            paths = [os.path.basename(f)]
+    def summary(self):
+        total = self.total()
+        per_file = total / self.files if self.files else 0
 
-        for rn in paths:
+        lines = ["-- Stats --"]
+        lines.append(f"files     : {self.files}")
 
-            renamer = Renamer(DEFAULT_RN_FILE, no_log = True)
+        for name, count in sorted(self.counts.items()):
+            lines.append(f"{name:<10}: {count}")
 
-            full_path = os.path.join(dir, rn)
+        # a sqlite commit is a few writes and syncs of its own, it is counted once
+        lines.append(f"syscalls  : {total} ({per_file:.2f} per file)")
 
-            print("{0}{1}:{2}".format(WARNING, full_path, ENDC))
+        return "\n".join(lines)
 
-            try:
-                os.chdir(dir)
 
-                with open(full_path, "rb") as rn_file:
-                    _ = rn_file.readline().decode()
-                    sep = get_sep(_, throw_error=True, error="Invalid .rn file cannot get separator")
-                    
-                    for line in rn_file:
-                        
-                        lined = line.decode()
 
-                        if lined.startswith("ERROR" + sep):
-                            if lined.count(sep) != 2: # if there is an error there will be 3 occurance of sep
-                                continue
-                        
-                        old_n, _, new_n = lined.partition(sep)
+class FileEntry:
+    """
+    A file found by scan_directory, wraps an os.DirEntry so the stat result is fetched at most once
 
-                        new_path =  new_n[:-1]
+        name   : the name of the file
+        path   : the full path of the file
+        hashes : dict of algorithm -> hex digest set by content_hash.ContentHasher
+        metadata : dict of width / height / duration / exif set by media_metadata.MetadataReader
+        stat() : the cached os.stat_result of the file
+    """
+    __slots__ = ("name", "path", "hashes", "metadata", "_entry", "_stat", "_stats")
 
-                        if os.path.exists(new_path):
-                            renamer.rename(new_path, old_n)
+    def __init__(self, entry, stats = None) -> None:
+        self.name = entry.name
+        self.path = entry.path
+        self.hashes = None
+        self.metadata = None
+        self._entry = entry
+        self._stat = None
+        self._stats = stats
 
-            except Exception as e:
-                print(FAIL, getattr(e, 'message', repr(e)), ENDC)
-            
-            finally:
-                os.chdir(cwd)
-    
-    os.chdir(cwd)
+    @classmethod
+    def from_path(cls, path, st = None, stats = None):
+        """A FileEntry for a file that was not found by os.scandir (ex: named by a --watch event)"""
 
+        self = cls.__new__(cls)
+        self.name = os.path.basename(path)
+        self.path = path
+        self.hashes = None
+        self.metadata = None
+        self._entry = None
+        self._stat = st
+        self._stats = stats
 
+        return self
 
-def get_parser():
-    import argparse
+    def stat(self):
+        if self._stat is None:
+            self._stat = self._entry.stat() if self._entry is not None else os.stat(self.path)
 
-    parser = argparse.ArgumentParser(
-        usage="%(prog)s [OPTION]... URL...",
-        add_help=False,
-    )
+            if self._stats:
+                self._stats.add("stat")
 
-    general = parser.add_argument_group("General Options")
-    general.add_argument(
-        "-h", "--help",
-        action="help",
-        help="Print this help message and exit",
-    )
+        return self._stat
 
-    rename = parser.add_argument_group("Rename Options")
-    rename.add_argument(
-        "-i", "--input",
-        dest="inputs", metavar="FOLDER", action="append",
-        help="Specify input directories"
-    )
-    rename.add_argument(
-        "-f", "--format",
-        dest="format", metavar="FORMAT",
-        help="Specify the format to rename"
-    )
-    rename.add_argument(
-        "-r", "--replace",
-        dest="replace", metavar="REPLACE:WITH", action="append",
-        help="Replace any occurance of anything before the last : with anything after the last :"
-    )
-    rename.add_argument(
-        "-u", "--undo",
-        dest="undo_file", metavar="FILE", action="append",
-        help="Undo any renaming done using the provided .rn file"
-    )
 
 
-    filter_ops = parser.add_argument_group("Filter Options")
-    filter_ops.add_argument(
-        "-sw", "--start-with",
-        dest="start_with", metavar="STR", action="append", default=[],
-        help="Only rename files that start with the given string (multiple --start-with can be specified)"
-    )
-    filter_ops.add_argument(
-        "-ew", "--ends-with",
-        dest="ends_with", metavar="STR", action="append",  default=[],
-        help="Only rename files that end with the given string (multiple --ends-with can be specified)"
-    )
-    filter_ops.add_argument(
-        "-m", "--match",
-        dest="matches", metavar="REGEX", action="append",  default=[],
-        help="Only rename if the filename matches any of the given regex"
-    )
-    
+def scan_directory(directory, stats = None, names = None, dirs = None):
+    """
+    Yields a FileEntry for every file in the given directory using a single os.scandir pass
 
-    after_rename = parser.add_argument_group("Undo File Options")
-    after_rename.add_argument(
-        "--no-file",
-        dest="no_rn_file", action="store_true",
-        help="Do not create .rn file"
-    )
-    after_rename.add_argument(
-        "-a", "--append-rn",
-        dest="append_rn_data", action="store_true",
-        help="Should file rename history be appended to existing .rn file"
-    )
-    after_rename.add_argument(
-        "-s", "--sep",
-        dest="sep", metavar="SEP", default=DEFAULT_SEP,
-        help="The separator character used in the .rn file"
-    )
+        - stats : a SyscallCounter to count the calls with
+        - names : a set that is filled with the name of every entry in the directory (files, folders, the .rn file)
+        - dirs  : a list that is filled with the path of every sub directory (symlinks are not followed)
+    """
 
-    help_options = parser.add_argument_group("Format Help")
-    help_options.add_argument(
-        "--date-formats",
-        dest="custom_date_formats", action="store_true",
-        help="Show all custom date formats"
-    )
-    help_options.add_argument(
-        "--format-help",
-        dest="display_formats", action="store_true",
-        help="Show format string variables"
-    )
-    
+    if stats:
+        stats.add("scandir")
 
-    return parser
+    with os.scandir(directory) as it:
 
+        for entry in it:
 
+            if names is not None:
+                names.add(entry.name)
 
-class Renamer:
+            if entry.name in JOURNAL_FILES:
+                continue
+
+            # is_file uses the d_type from the directory listing, so no extra stat on most filesystems
+            try:
+                if dirs is not None and entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                    continue
+
+                if not entry.is_file():
+                    continue
+
+            except OSError:
+                continue
+
+            yield FileEntry(entry, stats)
+
+
+
+def scan_tree(root, stats = None):
     """
-    A simple wrapper around os.rename that handles printing to the console and logging into a file
-    
-        __init__(directory, log_file, overwrite_existing, no_log)
-            - directory : the directory where files are going to be renamed
-            - log_file  : the name of the log file
-            - overwrite_existing : overwrite existing logfile, otherwise appends
-            - no_log : doesn't write anything to the log file
-        
-        rename(file_name, new_name) : renames the given file
-            - file_name : the name of the file relative to the given directory from __init__
-            - new_name  : the new name of the file relative to the given directory from __init__
-        log(text) : write the given text to the log file
-            - text : bytes / encoded text NOT string -> use string.encode()
-        close() : closes the log file
+    Yields (directory, file entries, names) for the root and every directory under it,
+    depth first in natural sort order, each directory is scanned exactly once
     """
-    def __init__(self, log_file, *, sep = "|", overwrite_existing = True, no_log = False) -> None:
-        
-        self.log_file_name = log_file
+    stack = [root]
 
-        self.logger = None
-        self.sep = sep
-        self.pad = 50
+    while stack:
 
-        if no_log:
-            return
+        dir = stack.pop()
+        names = set()
+        dirs = []
 
-        # get the path to the rn file
-        _ = log_file
+        try:
+            entries = list(scan_directory(dir, stats, names, dirs))
 
-        # if file exists, and the user wants to append logs to existing .rn file, 
-        # read the file and get the separator character,
-        if os.path.exists(_) and not overwrite_existing:
-            with open(_, "r") as fff:
-                self.sep = get_sep(fff.readline())
+        except OSError:
+            continue
 
-            self.logger = open(_, "ab")  
+        yield (dir, entries, names)
 
-        # else just override the old file
-        else:
-            # reading / writing as bytes because of foreign characters
-            self.logger = open(_, "wb")    
-            self.logger.write(f"sep={self.sep}\n".encode())
+        stack.extend(sorted(dirs, key=natural_sort_key, reverse=True))
 
-    def close(self):
-        if self.logger:
-            self.logger.close()
 
-    def log(self, text):
-        if not self.logger:
-            return 
 
-        self.logger.write(text)
+class FileFilter:
+    """
+    The --match / --start-with / --ends-with / --glob / --exclude filters compiled once into a single matcher
 
-    def rename(self, file_name, new_name):
+    every kind of filter given must match (any one of its patterns), and the name must not match any exclude
 
-        print('   {0:<{1}} '.format(file_name, self.pad), end="")
+        __init__(matches, start_with, ends_with, globs, excludes)
+            - matches    : list of regex, matched at the start of the name like re.match
+            - start_with : list of prefixes
+            - ends_with  : list of suffixes
+            - globs      : list of glob patterns the whole name must match (*.jpg)
+            - excludes   : list of glob patterns to skip
 
-        try:
-            os.rename(file_name, new_name)
+        __call__(name) : if the file with the given name should be renamed
+    """
+    def __init__(self, matches = (), start_with = (), ends_with = (), globs = (), excludes = ()) -> None:
 
-            self.log(f"{file_name}{self.sep}{new_name}\n".encode())
+        self.start_with = tuple(start_with)
+        self.ends_with = tuple(ends_with)
 
-            print('{0}-->{2} {1}'.format(OKGREEN, new_name, ENDC))
+        self.matches = self.combine(matches)
 
-        except Exception as e:
-            self.log(f"ERROR|{file_name}{self.sep}{new_name}\n".encode())
-            
-            print("{0}-->{2} {1}".format(FAIL, getattr(e, 'message', repr(e)), ENDC)) 
-            
+        flags = IGNORECASE if WINDOWS else 0
 
-class DigitTemplateGenerator:
-    """A class that returns a template string formatted with digits
-    
-    formats strings containing any 2 templates:
-       $[n:z]   where n is the starting number and z is the ending number (increment is 1 by default)
-       $[n:i:z] where n is the starting number, i is the increment and z is the ending number
-    example usage:
-        
-        template = "sample_$[1:100]"
-        d_format = DigitFormatter(template)
-        d_format.get_formatted_text() # -> sample_1
-        d_format.get_formatted_text() # -> sample_2
-        d_format.get_formatted_text() # -> sample_3
-         
+        self.globs = compile("|".join(translate(i) for i in globs), flags).match if globs else None
+        self.excludes = compile("|".join(translate(i) for i in excludes), flags).match if excludes else None
+
+        self.empty = not (self.start_with or self.ends_with or self.matches or self.globs or self.excludes)
+
+    @staticmethod
+    def combine(patterns):
+        """
+        Compiles a list of regex into one alternation, patterns with groups are kept separate since combining would renumber them,
+        and so are patterns with inline flags like (?i) since those are only allowed at the start of the whole regex
+        """
+
+        if not patterns:
+            return None
+
+        compiled = [compile(i) for i in patterns]
+        default = compile("").flags
+
+        simple = [i.pattern for i in compiled if i.groups == 0 and i.flags == default]
+        other  = [i.match for i in compiled if i.groups != 0 or i.flags != default]
+
+        if simple:
+            other.insert(0, compile("|".join(f"(?:{i})" for i in simple)).match)
+
+        if len(other) == 1:
+            return other[0]
+
+        return lambda name : any(m(name) for m in other)
+
+    def __call__(self, name):
+
+        if self.empty:
+            return True
+
+        if self.start_with and not name.startswith(self.start_with):
+            return False
+
+        if self.ends_with and not name.endswith(self.ends_with):
+            return False
+
+        if self.matches and not self.matches(name):
+            return False
+
+        if self.globs and not self.globs(name):
+            return False
+
+        if self.excludes and self.excludes(name):
+            return False
+
+        return True
+
+
+
+class Replacer:
     """
-    # split function for the digit formats $[1:1] or $[1:1:1]
-    DIGIT_SPLIT  = compile(r"\$\[-?\d+(?:\:-?\d+)?:-?\d+\]").split
+    The -r / --replace-regex pairs compiled into a single regex that does every replacement in one left to right pass
 
-    # matches $[1:9] or $[1:1:9]
-    DIGIT_MATCH  = compile(r"\$\[(-?\d+)(?:\:(-?\d+))?\:(-?\d+)\]")
+    at any position the longest literal key wins, then the regex pairs in the order they were given,
+    replaced text is never scanned again so one replacement cannot create a match for another
 
-    def __init__(self, template : str) -> None:
-        
-        self.split = [i for i in self.DIGIT_SPLIT(template)]
-        self.digits = []
-        self.digit_counter = []
-        self.end = len(self.split)
+        __init__(literal, regex)
+            - literal : dict of key -> replacement
+            - regex   : list of (pattern, replacement), the replacement can use \\1 / \\g<name> of its pattern
 
-        for i in self.DIGIT_MATCH.findall(template):
-            increment = 1 
+        __call__(name) : the name with every replacement applied
+    """
+    # \1 inside a pattern would point at the wrong group once the patterns are combined
+    NUMBERED_BACKREF = compile(r"(?<!\\)(?:\\\\)*\\[1-9]")
 
-            if i[1]:
-                increment = int(i[1])
+    # (?i) and the other global flags are only allowed at the start of the whole regex
+    GLOBAL_FLAGS = compile(r"\(\?([aiLmsux]+)\)")
 
-            # format the digits as ints (start, increment, max)
-            self.digits.append((int(i[0]), increment, int(i[2])))  
+    def __init__(self, literal = None, regex = ()) -> None:
 
-        self.reset()
-            
-    def get_next_string(self):
-        """Gets the name formatted with the current digits and increments all the digits"""
-        # begin building the name
-        name = ""
-        count = 0                                # loop count 
-        index = 0                                # index of the current digit position
-        for i in self.split:
-
-            # make sure its not the first or last loop
-            if count > 0 and count < self.end:
-                
-                # tuple (start, zfill) -> the starting digit, and the zfill 
-                d = self.digit_counter[index]         
-
-                # append the current digit to the string and apply zfill
-                name += f"{d[0]}".zfill(d[1])         
-
-                # (start, zfill)[0] < (start, increment, max)[2] 
-                # if less than max increase by the increment amount
-                if d[0] < self.digits[index][2]:
-
-                    self.digit_counter[index][0] += self.digits[index][1]
-
-                # move to next index 
-                index += 1 
-            
-            # append the string
-            name += i 
-            count += 1
+        self.literal = dict(literal or {})
+        self.regex = [(compile(p), r) for p, r in regex]
 
-        return name 
+        self.empty = not self.literal and not self.regex
 
-    def reset(self):
-        """Resets all the counters for each digit"""
-        # reset / init the digit counter array 
-        self.digit_counter = []
-        for dig in self.digits: 
-            # dig[0] = start number
-            # dig[2] = end number
-            start = dig[0] 
-            pad_zeros = len(str(dig[2]))
+        if self.empty:
+            return
 
-            self.digit_counter.append([start, pad_zeros])
+        alternatives = []
 
+        if self.literal:
+            # longest first so "abc" wins over "ab" at the same position
+            keys = sorted((k for k in self.literal if k), key=len, reverse=True)
 
-class TextFormatter:
+            if keys:
+                alternatives.append("(?P<lit>{0})".format("|".join(escape(k) for k in keys)))
 
-    RE_EXT     = compile(r"\$\[EXT\]")                # repalce file extension
-    RE_RAND    = compile(r"\$\[RND\:(\d+)\:(\d+)\]")  # random number
+        # every regex is wrapped in a named group, the outer group closes last so lastgroup tells which one matched
+        for i, (pattern, _) in enumerate(self.regex):
 
-    def __init__(self) -> None:
-        self.file_ext = ""
+            if pattern.groups and self.NUMBERED_BACKREF.search(pattern.pattern):
+                raise ValueError(f"numbered backreferences are not supported in --replace-regex, use (?P<name>...) and (?P=name): {pattern.pattern}")
 
-    def add_context(self, context):
+            alternatives.append(f"(?P<re{i}>{self.scope_flags(pattern.pattern)})")
 
-        ext = context.rsplit(".", 1)
+        self.empty = not alternatives
+        self.sub = compile("|".join(alternatives)).sub if alternatives else None
 
-        if len(ext) > 1:
-            self.file_ext = ext[-1]
+    @classmethod
+    def scope_flags(cls, pattern):
+        """Turns the global flags at the start of a pattern into a scoped group, (?i)foo -> (?i:foo)"""
 
-        else:
-            self.file_ext = ""
+        flags = ""
+        start = 0
 
-    def format_text(self, text):
+        m = cls.GLOBAL_FLAGS.match(pattern)
 
-        text = self.RE_EXT.sub(self.file_ext, text)  
+        while m:
+            flags += m.group(1)
+            start = m.end()
+            m = cls.GLOBAL_FLAGS.match(pattern, start)
 
-        # random number
-        for i in self.RE_RAND.findall(text):
-            text = self.RE_RAND.sub(str(random.randint(int(i[0]), int(i[1]))), text, 1)
+        if not flags:
+            return pattern
 
-        return text 
+        # a verbose pattern can end in a # comment, which would swallow the closing parenthesis
+        return f"(?{flags}:{pattern[start:]}\n)" if "x" in flags else f"(?{flags}:{pattern[start:]})"
 
+    def replace_match(self, m):
 
-class DateFormatter(TextFormatter):
+        if m.lastgroup == "lit":
+            return self.literal[m.group("lit")]
 
-    SUB_MAP = {
-        "FDM" : compile(r"\$\[FDM\]").sub,
-        "FDC" : compile(r"\$\[FDC\]").sub,
-        "CD"  : compile(r"\$\[CD\]").sub
-    }
+        (pattern, replacement) = self.regex[int(m.lastgroup[2:])]
 
-    # matches $[FDM]  or $[FDC] pr $[CD]
-    MATCH_SIMPLE_DATE = compile(r"\$\[(FDM|FDC|CD)\]")
-    
-    # matches $[FDM: 'anything that is not [ or ]' ]
-    # matches $[FDC: 'anything that is not [ or ]' ]
-    MATCH_CUSTOM_DATE = compile(r"\$\[(FDM|FDC|CD):([^\]]+)\]")      
+        # match the pattern on its own at the same spot so its groups keep their own numbers
+        return pattern.match(m.string, m.start()).expand(replacement)
 
-    def __init__(self, *, default_date_format = "%Y-%m-%d", require_file_exist = True) -> None:
-        
-        TextFormatter.__init__(self)
+    def __call__(self, name):
 
-        self.file_name = ""
+        if self.empty:
+            return name
 
-        self.date_format = default_date_format
-        self.require_file_exist = require_file_exist
-        
-    def add_context(self, context):
-        """Set the filename for formatting file date created / modified"""
-        
-        self.file_name = context
+        return self.sub(self.replace_match, name)
 
-    def format_text(self, template):
 
-        name = template
-        file_date_created = 0
-        file_date_modified = 0
 
-        if os.path.isfile(self.file_name):
-            file_date_created = os.stat(self.file_name).st_ctime
-            file_date_modified = os.stat(self.file_name).st_mtime
+def read_replace_file(path):
+    """Reads KEY:WITH pairs from a file, one per line, lines starting with # are ignored, returns a list of (key, replacement)"""
 
-        elif self.require_file_exist:
-            raise Exception("DateFormatter.get_formatted_text -> given file does not exist, requires the file exists")
-            
-        for i in set(self.MATCH_SIMPLE_DATE.findall(template)):
+    pairs = []
 
-            if i == "FDM":
-                name = self.SUB_MAP[i](datetime.fromtimestamp(file_date_modified).strftime(self.date_format), name)
-            
-            elif i == "FDC":
-                name = self.SUB_MAP[i](datetime.fromtimestamp(file_date_created).strftime(self.date_format), name)
+    with open(path, "r", encoding="utf-8") as f:
 
-            elif i == "CD":
-                name = self.SUB_MAP[i](datetime.fromtimestamp(datetime.now().timestamp()).strftime(self.date_format), name)
+        for line in f:
 
+            line = line.rstrip("\r\n")
 
-        for i in self.MATCH_CUSTOM_DATE.findall(template):
+            if not line or line.startswith("#"):
+                continue
 
-            if i[0] == "FDM":
-                name = self.MATCH_CUSTOM_DATE.sub(datetime.fromtimestamp(file_date_modified).strftime(i[1]), name, 1)
+            _ = line.rsplit(":", 1)
 
-            elif i[0] == "FDC":
-                name = self.MATCH_CUSTOM_DATE.sub(datetime.fromtimestamp(file_date_created).strftime(i[1]), name, 1)
-                
-            elif i[0] == "CD":
-                name = self.MATCH_CUSTOM_DATE.sub(datetime.fromtimestamp(datetime.now().timestamp()).strftime(i[1]), name, 1)
-        
-        return name
+            if len(_) == 2:
+                pairs.append((_[0], _[1]))
 
+    return pairs
 
 
 
-def main():
+def get_temp_name(name, taken):
+    """Gets a temporary name similar to the given name that is not in the taken set (compared with os.path.normcase)"""
+    temp = f"{name}.rntmp"
+    count = 0
 
-    parser = get_parser()
-    args = parser.parse_args()
+    while os.path.normcase(temp) in taken:
+        count += 1
+        temp = f"{name}.{count}.rntmp"
 
-    if args.display_formats:
-        print(FORMAT_HELP_MESSAGE)
-        return
+    taken.add(os.path.normcase(temp))
 
-    if args.custom_date_formats:
-        print(DATE_FORMAT_HELP_MESSAGE)
-        return 
+    return temp
 
-    if args.undo_file:
-        handle_undo(args.undo_file)
-        return
 
-    if not args.inputs:
-        parser.error("No inputs specified")
-        return 
 
-    if not args.format and not args.replace:
-        print("No output format or replace specified use -f \"FORMAT\" to specify a format --format-help for more info\nor -r 'word:replacement' to replace words")
-        return
+def plan_renames(plan, existing):
+    """
+    Orders a list of renames so they can be applied one after another without overwriting anything
 
-    
-    _replace = {} 
-    _format  = args.format
+        - plan     : list of (file_name, new_name) in the order the names were generated
+        - existing : every name currently in the directory
 
-    # filters 
-    _ends_with   = args.ends_with
-    _starts_with = args.start_with
-    _regex       = args.matches
+    returns (steps, collisions)
+        - steps      : list of (file_name, new_name) to apply in order, cycles like a->b, b->a
+                       are broken with a single temporary name per cycle
+        - collisions : list of (file_name, new_name) that would overwrite another file or share a target,
+                       when this is not empty nothing should be renamed
+    """
+    key = os.path.normcase
 
-    # rename instance args 
-    _no_log             = args.no_rn_file
-    _sep                = args.sep
-    _overwrite_existing = not args.append_rn_data
+    plan = [(old, new) for old, new in plan if old != new]
 
-    # directories to rename
-    _directories = set()
+    sources = {key(old) : (old, new) for old, new in plan}
+    taken = set(key(i) for i in existing)
 
+    targets = set()
+    collisions = []
 
+    for old, new in plan:
 
-    if args.replace:                  # replace specified
+        k = key(new)
 
-        for i in args.replace:        # go through all given strings
-            
-            _ = i.rsplit(":", 1)      # split at last occurance of :
-            
-            if len(_) == 2:           # if there is not 2 items skip
-                _replace[_[0]] = _[1] # set dict 
+        if k in targets or (k in taken and k not in sources):
+            collisions.append((old, new))
 
+        targets.add(k)
 
+    if collisions:
+        return ([], collisions)
 
-    for i in args.inputs:
+    taken.update(targets)
 
-        if not os.path.exists(i):
+    # every file has at most one rename going out and, without collisions, at most one coming in,
+    # so the renames form simple chains (a->b->c->free) and cycles (a->b->a)
+    next_of = {}
+
+    for old, new in plan:
+
+        if key(new) in sources and key(new) != key(old):
+            next_of[key(old)] = key(new)
+
+    has_incoming = set(next_of.values())
+
+    steps = []
+    done = set()
+
+    # chains are applied from the end, so every target is free when it is renamed onto
+    for k in sources:
+
+        if k in has_incoming or k in done:
             continue
 
-        if os.path.isdir(i):
-            _directories.add(os.path.abspath(i))
+        chain = []
 
+        while k is not None and k not in done:
+            chain.append(k)
+            done.add(k)
+            k = next_of.get(k)
 
-    
-    standard_format = TextFormatter()
-    date_format     = DateFormatter()
-    digit_format    = DigitTemplateGenerator(_format)
-    
-    cwd = os.getcwd()
+        steps.extend(sources[i] for i in reversed(chain))
 
-    for dir in _directories:
+    # whatever is left is a cycle, move its first file out of the way, rotate the rest, then move it back in
+    for k in sources:
 
-        renamer = Renamer(os.path.join(dir, DEFAULT_RN_FILE), 
-                          sep = _sep,
-                          overwrite_existing = _overwrite_existing, 
-                          no_log = _no_log)
+        if k in done:
+            continue
 
-        digit_format.reset()
+        cycle = []
 
-        print("{0}{1}:{2}".format(WARNING, dir, ENDC))
+        while k not in done:
+            cycle.append(k)
+            done.add(k)
+            k = next_of[k]
 
-        try:
-            os.chdir(dir)
+        (first_old, first_new) = sources[cycle[0]]
+        temp = get_temp_name(first_old, taken)
 
-            files = sorted(os.listdir(dir), key=natural_sort_key)
+        steps.append((first_old, temp))
+        steps.extend(sources[i] for i in reversed(cycle[1:]))
+        steps.append((temp, first_new))
 
-            renamer.pad = len(max(files, key=len))
+    return (steps, collisions)
 
-            for file in files:
 
-                if not os.path.isfile(file):
-                    continue
 
-                if file == DEFAULT_RN_FILE:
+def undo_entry(renamer, new_n, old_n, counts):
+    """Renames a single journal entry back, a file that no longer exists is skipped"""
+
+    # no exists check, a missing file is just skipped
+    error = renamer.try_rename(new_n, old_n)
+
+    if isinstance(error, FileNotFoundError):
+        counts["skipped"] += 1
+
+    elif renamer.report(new_n, old_n, error):
+        counts["restored"] += 1
+
+    else:
+        counts["failed"] += 1
+
+
+
+def undo_text_journal(renamer, rn, counts):
+    """Renames every file logged in the given .rn file back, newest first"""
+
+    with open(os.path.join(renamer.directory, rn), "rb") as rn_file:
+        _ = rn_file.readline().decode()
+        sep = get_sep(_, throw_error=True, error="Invalid .rn file cannot get separator")
+        
+        # undo newest first, so chained renames and temporary names unwind correctly
+        for line in reversed(rn_file.readlines()):
+            
+            lined = line.decode()
+
+            if lined.startswith("ERROR" + sep):
+                if lined.count(sep) != 2: # if there is an error there will be 3 occurance of sep
                     continue
+            
+            old_n, _, new_n = lined.partition(sep)
 
-                if _regex:
-                    if not any(match(regex, file) for regex in _regex):
-                        continue
-                
-                if _starts_with:
-                    if not any([file.startswith(i) for i in _starts_with]):
-                        continue
-                
-                if _ends_with:
-                    if not any([file.endswith(i) for i in _ends_with]):
-                        continue
-                
-                n_file = file
+            undo_entry(renamer, new_n[:-1], old_n, counts)
 
-                if _format:
 
-                    n_file = digit_format.get_next_string()
 
-                    date_format.add_context(file)
-                    n_file = date_format.format_text(n_file)
+def undo_sqlite_journal(renamer, db, counts, batch = None):
+    """Renames every file logged in the given .rndb journal back, newest batch first, or only the given batch"""
 
-                    standard_format.add_context(file)
-                    n_file = standard_format.format_text(n_file)
+    with SqliteJournal.open_existing(os.path.join(renamer.directory, db)) as journal:
 
+        for batch_id, started, directory in journal.batches(batch):
 
-                if _replace:
+            if renamer.output == "normal":
+                print("   {0}batch {1} from {2}:{3}".format(OKCYAN, batch_id, datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"), ENDC))
 
-                    for key, value in _replace.items():
-                    
-                        n_file = n_file.replace(key, value)
+            for old_n, new_n in journal.entries(batch_id):
 
+                undo_entry(renamer, new_n, old_n, counts)
 
-                n_file = RM_INVALID(REPLACE_INVALID, n_file)
+            journal.mark_undone(batch_id)
 
-                renamer.rename(file, n_file)
 
 
-        except OSError as e:
-            pass 
+def rewrite_journal(dir, header, steps):
+    """Replaces the entries a killed run wrote to the .rn / .rndb journal of a directory with the renames that are really done"""
 
-        finally:
-            os.chdir(cwd)
+    kind = header.get("journal")
+    position = header.get("position")
 
-            # close our log file
-            renamer.close()
+    if kind == "text":
+        sep = header.get("sep", DEFAULT_SEP)
+        rn = os.path.join(dir, DEFAULT_RN_FILE)
+
+        with open(rn, "r+b" if os.path.exists(rn) else "wb") as f:
+
+            # cut off whatever the killed run got to write, never past the end of the file
+            f.seek(min(position, f.seek(0, os.SEEK_END)))
+            f.truncate()
+
+            if f.tell() == 0:
+                f.write(f"sep={sep}\n".encode())
+
+            f.write(b"".join(f"{old}{sep}{new}\n".encode() for old, new in steps))
+            f.flush()
+            os.fsync(f.fileno())
+
+    elif kind == "sqlite":
+        (batch, seq) = position
+
+        with SqliteJournal(os.path.join(dir, DEFAULT_RN_DB_FILE)) as journal:
+            journal.replace_entries(batch, seq, steps)
+
+
+
+def recover_directory(dir, mode = "forward", output = "normal"):
+    """
+    Finishes (mode forward) or undoes (mode back) the renames of a killed run from the .rnwal of a directory,
+    the journal of that run is rewritten to match and the .rnwal is deleted, returns the number of files renamed
+
+    nothing is ever renamed onto a file that exists, when a step would be the renames done so far
+    are written to the .rnwal, which is kept, and FileExistsError is raised
+    """
+    path = os.path.join(dir, DEFAULT_RN_WAL_FILE)
+    state = WriteAheadLog.read(path)
+    renamed = 0
+
+    # without a full plan the killed run never started renaming
+    if state is not None:
+
+        (header, plan, marked, failed) = state
+
+        renamer = Renamer(DEFAULT_RN_FILE, no_log = True, output = output, directory = dir)
+
+        if plan:
+            renamer.pad = len(max((old for old, _ in plan), key=len))
+
+        if output == "normal":
+            print("{0}{1}: recovering a killed run ({2}){3}".format(WARNING, dir, mode, ENDC))
+
+        done = [i in marked for i in range(len(plan))]
+
+        # the marks are written in batches, so the newest steps done may have none, those are read from the files:
+        # going from the last step to the first with the steps after it undone, a step is done when its new name
+        # is there and its old name is not, a step that did not run still has its old name, since only a later
+        # step that depends on it could fill the old name again
+        #
+        # a name made by an earlier step (the temporary name of a cycle) is not there before that step either,
+        # rename_all writes the mark of such a step before going on, so without the mark the later step did not run
+        made_by = {new : i for i, (_, new) in enumerate(plan)}
+        present = set(name for step in plan for name in step if os.path.lexists(os.path.join(dir, name)))
+
+        for i in reversed(range(len(plan))):
+
+            (old, new) = plan[i]
+
+            if i not in marked and i not in failed:
+                j = made_by.get(old)
+
+                done[i] = new in present and old not in present and (j is None or j > i or j in marked)
+
+            if done[i]:
+                present.discard(new)
+                present.add(old)
+
+        for i in range(len(plan)) if mode == "forward" else reversed(range(len(plan))):
+
+            (old, new) = plan[i]
+
+            if mode == "forward":
+                if done[i] or i in failed:
+                    continue
+
+            elif done[i]:
+                (old, new) = (new, old)
+
+            else:
+                continue
+
+            # a case only rename finds its own file
+            if os.path.lexists(os.path.join(dir, new)) and os.path.normcase(old) != os.path.normcase(new):
+                WriteAheadLog.replace(path, header, plan, set(i for i, ok in enumerate(done) if ok), failed)
+
+                raise FileExistsError(f"{os.path.join(dir, new)} already exists, the killed run cannot be recovered "
+                                      f"without overwriting it, {DEFAULT_RN_WAL_FILE} is kept")
+
+            if renamer.rename(old, new):
+                done[i] = mode == "forward"
+                renamed += 1
+
+            elif mode == "forward":
+                failed.add(i)
+
+        rewrite_journal(dir, header, [step for step, ok in zip(plan, done) if ok])
+
+    os.remove(path)
+
+    return renamed
+
+
+
+def undo_directory(dir, journals, batch = None, output = "normal", errors = None):
+    """
+    Undoes every given journal in a directory one after another, returns the restored / skipped / failed counts,
+    errors is a list that gets (path, old name, exception) of every file that could not be renamed back
+    """
+
+    counts = {"restored" : 0, "skipped" : 0, "failed" : 0}
+
+    # the journal of a killed run is only complete once the run is recovered
+    if os.path.lexists(os.path.join(dir, DEFAULT_RN_WAL_FILE)):
+        try:
+            counts["restored"] += recover_directory(dir, "back", output)
+
+        except FileExistsError as e:
+            counts["failed"] += 1
+
+            if errors is not None:
+                errors.append((os.path.join(dir, DEFAULT_RN_WAL_FILE), None, e))
+
+            if output != "silent":
+                print("{0}{1}: {2}{3}".format(FAIL, dir, e, ENDC))
+
+            # the journals are missing what the killed run did, undoing them now would only undo part of it
+            return counts
+
+    renamer = Renamer(DEFAULT_RN_FILE, no_log = True, output = output, directory = dir)
+
+    # the most recently written journal is undone first
+    journals = sorted(journals, key=lambda x : os.path.getmtime(os.path.join(dir, x)), reverse=True)
+
+    for rn in journals:
+
+        if output == "normal":
+            print("{0}{1}:{2}".format(WARNING, os.path.join(dir, rn), ENDC))
+
+        try:
+            if rn == DEFAULT_RN_DB_FILE:
+                undo_sqlite_journal(renamer, rn, counts, batch)
+
+            else:
+                undo_text_journal(renamer, rn, counts)
+
+        except Exception as e:
+            counts["failed"] += 1
+            renamer.errors.append((rn, None, e))
+
+            if output != "silent":
+                print("{0}{1}: {2}{3}".format(FAIL, os.path.join(dir, rn), getattr(e, 'message', repr(e)), ENDC))
+
+    if errors is not None:
+        errors.extend((os.path.join(dir, new), old, e) for new, old, e in renamer.errors)
+
+    return counts
+
+
+
+def is_journal(name):
+    return name.endswith(".rn") or name == DEFAULT_RN_DB_FILE
+
+
+
+def find_journals(paths, recursive = False):
+    """Returns a dict of directory -> list of journal file names found in the given files / directories"""
+
+    found = {}
+
+    for f in paths:
+
+        if os.path.isfile(f):
+            found.setdefault(os.path.dirname(os.path.abspath(f)), []).append(os.path.basename(f))
+            continue
+
+        if not os.path.isdir(f):
+            continue
+
+        if not recursive:
+            dir = os.path.abspath(f)
+            names = [i for i in os.listdir(dir) if is_journal(i)]
+
+            if names:
+                found.setdefault(dir, []).extend(names)
+
+            continue
+
+        # os.walk is scandir based, so this is a single pass over the tree
+        for dir, _, files in os.walk(os.path.abspath(f)):
+
+            names = [i for i in files if is_journal(i)]
+
+            if names:
+                found.setdefault(dir, []).extend(names)
+
+    return found
+
+
+
+def list_journal_batches(file : list):
+    """Prints the batches recorded in the given .rndb journals or directories containing one"""
+
+    for f in file:
+
+        if os.path.isdir(f):
+            f = os.path.join(f, DEFAULT_RN_DB_FILE)
+
+        if not os.path.isfile(f) or not f.endswith(DEFAULT_RN_DB_FILE):
+            continue
+
+        print("{0}{1}:{2}".format(WARNING, os.path.abspath(f), ENDC))
+
+        with SqliteJournal.open_existing(f) as journal:
+
+            for batch_id, started, directory, count, undone in journal.summary():
+
+                print("   {0:<6} {1}  {2:>8} renames  {3}{4}".format(
+                    batch_id, datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+                    count, directory, "  (undone)" if undone else ""))
+
+
+
+def undo_journals(found, batch = None, *, jobs = 1, output = "normal", errors = None):
+    """Undoes the journals from find_journals, on a thread pool with jobs > 1, returns the total restored / skipped / failed counts"""
+
+    total = {"restored" : 0, "skipped" : 0, "failed" : 0}
+
+    # output from several directories at once would interleave, so only print errors
+    if jobs > 1 and len(found) > 1 and output == "normal":
+        output = "quiet"
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+
+        futures = [pool.submit(undo_directory, dir, journals, batch, output, errors) for dir, journals in found.items()]
+
+        for future in futures:
+
+            for key, value in future.result().items():
+                total[key] += value
+
+    return total
+
+
+
+def handle_undo(file : list, batch = None, *, recursive = False, jobs = 1, output = "normal"):
+    """
+    Reads a list of [.rn] / [.rndb] files (or directories containing them) and renames
+    all existing files back to before being renamed for each file
+
+    directories are independent of each other so with jobs > 1 they are undone on a thread pool,
+    returns the total restored / skipped / failed counts
+    """
+    total = undo_journals(find_journals(file, recursive), batch, jobs = jobs, output = output)
+
+    print("restored {0}{1}{4}, skipped {2}, failed {5}{3}{4}".format(
+        OKGREEN, total["restored"], total["skipped"], total["failed"], ENDC, FAIL if total["failed"] else ""))
+
+    return total
+
+
+
+def get_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]... URL...",
+        add_help=False,
+    )
+
+    general = parser.add_argument_group("General Options")
+    general.add_argument(
+        "-h", "--help",
+        action="help",
+        help="Print this help message and exit",
+    )
+
+    rename = parser.add_argument_group("Rename Options")
+    rename.add_argument(
+        "-i", "--input",
+        dest="inputs", metavar="FOLDER", action="append",
+        help="Specify input directories"
+    )
+    rename.add_argument(
+        "-f", "--format",
+        dest="format", metavar="FORMAT",
+        help="Specify the format to rename"
+    )
+    rename.add_argument(
+        "-r", "--replace",
+        dest="replace", metavar="REPLACE:WITH", action="append",
+        help="Replace any occurance of anything before the last : with anything after the last :, all replacements are done in a single pass"
+    )
+    rename.add_argument(
+        "-rr", "--replace-regex",
+        dest="replace_regex", metavar="REGEX:WITH", action="append",
+        help="Like --replace but the part before the last : is a regex, and \\1 in the replacement is its first group"
+    )
+    rename.add_argument(
+        "-rf", "--replace-file",
+        dest="replace_file", metavar="FILE", action="append",
+        help="Read --replace pairs from a file, one REPLACE:WITH per line, lines starting with # are ignored"
+    )
+    rename.add_argument(
+        "-u", "--undo",
+        dest="undo_file", metavar="FILE", action="append",
+        help="Undo any renaming done using the provided .rn / .rndb file (or every one in a directory)"
+    )
+
+
+    filter_ops = parser.add_argument_group("Filter Options")
+    filter_ops.add_argument(
+        "-sw", "--start-with",
+        dest="start_with", metavar="STR", action="append", default=[],
+        help="Only rename files that start with the given string (multiple --start-with can be specified)"
+    )
+    filter_ops.add_argument(
+        "-ew", "--ends-with",
+        dest="ends_with", metavar="STR", action="append",  default=[],
+        help="Only rename files that end with the given string (multiple --ends-with can be specified)"
+    )
+    filter_ops.add_argument(
+        "-m", "--match",
+        dest="matches", metavar="REGEX", action="append",  default=[],
+        help="Only rename if the filename matches any of the given regex"
+    )
+    filter_ops.add_argument(
+        "-g", "--glob",
+        dest="globs", metavar="GLOB", action="append",  default=[],
+        help="Only rename if the filename matches any of the given glob patterns, ex: *.jpg"
+    )
+    filter_ops.add_argument(
+        "-x", "--exclude",
+        dest="excludes", metavar="GLOB", action="append",  default=[],
+        help="Do not rename files matching any of the given glob patterns"
+    )
+    
+
+    after_rename = parser.add_argument_group("Undo File Options")
+    after_rename.add_argument(
+        "--no-file",
+        dest="no_rn_file", action="store_true",
+        help="Do not create .rn file"
+    )
+    after_rename.add_argument(
+        "-a", "--append-rn",
+        dest="append_rn_data", action="store_true",
+        help="Should file rename history be appended to existing .rn file"
+    )
+    after_rename.add_argument(
+        "-s", "--sep",
+        dest="sep", metavar="SEP", default=DEFAULT_SEP,
+        help="The separator character used in the .rn file"
+    )
+
+    after_rename.add_argument(
+        "--journal",
+        dest="journal", choices=JOURNAL_FORMATS, default="text",
+        help="Write a text .rn file (default) or an indexed .rndb sqlite journal that can undo single runs"
+    )
+    after_rename.add_argument(
+        "--undo-batch",
+        dest="undo_batch", metavar="ID", type=int,
+        help="With -u and a .rndb journal, only undo the run with the given batch id"
+    )
+    after_rename.add_argument(
+        "--list-batches",
+        dest="list_batches", metavar="FILE", action="append",
+        help="List the runs recorded in a .rndb journal (or a directory containing one)"
+    )
+    after_rename.add_argument(
+        "--fsync",
+        dest="fsync", choices=FSYNC_POLICIES, default="batch",
+        help="When the .rn file is flushed to disk: never, after every batch of entries (default), or after every entry"
+    )
+    after_rename.add_argument(
+        "--recover",
+        dest="recover", choices=RECOVER_MODES, default="forward",
+        help="When a directory has a .rnwal left by a killed run, finish its renames (default) or undo them before renaming"
+    )
+    after_rename.add_argument(
+        "--no-wal",
+        dest="no_wal", action="store_true",
+        help="Do not write the .rnwal plan before renaming, a killed run can then leave a directory half renamed"
+    )
+
+    hash_ops = parser.add_argument_group("Hash Options")
+    hash_ops.add_argument(
+        "--hash-jobs",
+        dest="hash_jobs", metavar="N", type=int,
+        help="Number of processes hashing files for $[SHA1] / $[XXH] ... (default the cpu count)"
+    )
+    hash_ops.add_argument(
+        "--hash-cache",
+        dest="hash_cache", metavar="FILE",
+        help="Where hashes are cached by path, size and date modified (default rename_hashes.db in the user cache directory)"
+    )
+    hash_ops.add_argument(
+        "--no-hash-cache",
+        dest="no_hash_cache", action="store_true",
+        help="Do not read or write the hash cache"
+    )
+
+    metadata_ops = parser.add_argument_group("Metadata Options")
+    metadata_ops.add_argument(
+        "--metadata-cache",
+        dest="metadata_cache", metavar="FILE",
+        help="Where the $[WIDTH] / $[EXIF:...] ... values are cached by path, size and date modified (default rename_metadata.db in the user cache directory)"
+    )
+    metadata_ops.add_argument(
+        "--no-metadata-cache",
+        dest="no_metadata_cache", action="store_true",
+        help="Do not read or write the metadata cache"
+    )
+
+    watch_ops = parser.add_argument_group("Watch Options")
+    watch_ops.add_argument(
+        "-w", "--watch",
+        dest="watch", action="store_true",
+        help="Keep running and rename new files as they are added to the input directories, until ctrl+c"
+    )
+    watch_ops.add_argument(
+        "--poll",
+        dest="poll", action="store_true",
+        help="With --watch, list the directories every --poll-interval instead of using inotify (always used off linux)"
+    )
+    watch_ops.add_argument(
+        "--poll-interval",
+        dest="poll_interval", metavar="SECONDS", type=float,
+        help="Seconds between listing the directories when polling (default 2)"
+    )
+
+    other_ops = parser.add_argument_group("Other Options")
+    other_ops.add_argument(
+        "-q", "--quiet",
+        dest="output", action="store_const", const="quiet", default="normal",
+        help="Only print errors instead of a line per renamed file"
+    )
+    other_ops.add_argument(
+        "-p", "--progress",
+        dest="output", action="store_const", const="progress",
+        help="Show a progress bar instead of a line per renamed file"
+    )
+    other_ops.add_argument(
+        "-n", "--dry-run",
+        dest="dry_run", action="store_true",
+        help="Print the renames that would be done without renaming anything or writing a .rn file"
+    )
+    other_ops.add_argument(
+        "-j", "--jobs",
+        dest="jobs", metavar="N", type=int, default=1,
+        help="Number of threads used to rename the files of each directory, or the directories undone at once with -u"
+    )
+    other_ops.add_argument(
+        "-R", "--recursive",
+        dest="recursive", action="store_true",
+        help="Rename the files of every sub directory too (one .rn per directory), with -u look for .rn / .rndb files in every sub directory"
+    )
+    other_ops.add_argument(
+        "--counter",
+        dest="counter", choices=("per-dir", "global"), default="per-dir",
+        help="With --recursive, restart the $[n:z] counters in every directory (default) or keep counting across them"
+    )
+    other_ops.add_argument(
+        "--stats",
+        dest="stats", action="store_true",
+        help="Print a summary of the files renamed and filesystem calls made"
+    )
+
+    help_options = parser.add_argument_group("Format Help")
+    help_options.add_argument(
+        "--date-formats",
+        dest="custom_date_formats", action="store_true",
+        help="Show all custom date formats"
+    )
+    help_options.add_argument(
+        "--format-help",
+        dest="display_formats", action="store_true",
+        help="Show format string variables"
+    )
+    
+
+    return parser
+
+
+
+class LogWriter:
+    """
+    Batches the entries of a .rn file in memory and writes them in large chunks
+
+        __init__(path, mode, fsync, chunk_size, stats)
+            - path  : the path of the log file
+            - mode  : the mode to open the file with, "wb" or "ab"
+            - fsync : one of FSYNC_POLICIES
+            - chunk_size : the number of buffered bytes that triggers a write
+            - stats : a SyscallCounter to count the writes and fsyncs with
+
+        write(data) : buffer the given bytes
+        flush()     : write everything buffered to the file
+        close()     : flush and close the file
+    """
+    def __init__(self, path, mode = "wb", *, fsync = "batch", chunk_size = LOG_CHUNK_SIZE, stats = None) -> None:
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, given: {fsync}")
+
+        self.file = open(path, mode, buffering=0)
+        self.fsync = fsync
+        self.chunk_size = chunk_size
+        self.stats = stats
+
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+
+        self.buffer.append(data)
+        self.buffered += len(data)
+
+        if self.fsync == "every" or self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+
+        if not self.buffer:
+            return
+
+        self.file.write(b"".join(self.buffer))
+
+        self.buffer = []
+        self.buffered = 0
+
+        if self.stats:
+            self.stats.add("write")
+
+        if self.fsync != "never":
+            os.fsync(self.file.fileno())
+
+            if self.stats:
+                self.stats.add("fsync")
+
+    def close(self):
+
+        try:
+            self.flush()
+
+        finally:
+            self.file.close()
+
+
+
+class SqliteJournal:
+    """
+    An indexed rename journal stored in a sqlite database,
+    every run of the renamer is a batch with an id, a start time and the directory it renamed
+
+        __init__(path, directory, fsync, chunk_size)
+            - path      : the path of the database
+            - directory : the directory being renamed, None to open without starting a batch
+            - fsync     : one of FSYNC_POLICIES, maps to the sqlite synchronous pragma
+            - chunk_size : the number of entries inserted per transaction
+            - stats     : a SyscallCounter to count the commits with
+
+        add(old, new, ok)     : buffer an entry of the current batch
+        batches(batch)        : (id, started, directory) of the batches still to undo, newest first
+        entries(batch)        : (old, new) of the successful renames of a batch, newest first
+        mark_undone(batch)    : flags a batch so it is not undone twice
+        replace_entries(batch, seq, steps) : replaces the entries of a batch from seq on with the given (old, new) renames
+        summary()             : (id, started, directory, count, undone) of every batch
+        close()               : flush and close the database
+
+    text .rn files are still written by default and both can be undone with -u
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS batch (
+        id        INTEGER PRIMARY KEY,
+        started   REAL NOT NULL,
+        directory TEXT NOT NULL,
+        undone    INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS entry (
+        batch INTEGER NOT NULL,
+        seq   INTEGER NOT NULL,
+        old   TEXT NOT NULL,
+        new   TEXT NOT NULL,
+        ok    INTEGER NOT NULL,
+        PRIMARY KEY (batch, seq)
+    ) WITHOUT ROWID;
+    """
+
+    SYNCHRONOUS = {"never" : "OFF", "batch" : "NORMAL", "every" : "FULL"}
+
+    def __init__(self, path, directory = None, *, fsync = "batch", chunk_size = 10000, stats = None) -> None:
+
+        import sqlite3
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, given: {fsync}")
+
+        self.db = sqlite3.connect(path)
+        self.db.execute(f"PRAGMA synchronous = {self.SYNCHRONOUS[fsync]}")
+        self.db.executescript(self.SCHEMA)
+
+        self.fsync = fsync
+        self.chunk_size = chunk_size
+        self.stats = stats
+        self.buffer = []
+        self.seq = 0
+        self.batch = None
+
+        if directory is not None:
+            with self.db:
+                self.batch = self.db.execute("INSERT INTO batch (started, directory) VALUES (?, ?)",
+                                             (time.time(), directory)).lastrowid
+
+    @classmethod
+    def open_existing(cls, path):
+
+        if not os.path.isfile(path):
+            raise OSError(f"journal '{path}' does not exist")
+
+        return cls(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, old, new, ok):
+
+        self.buffer.append((self.batch, self.seq, old, new, int(ok)))
+        self.seq += 1
+
+        if self.fsync == "every" or len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+
+        if not self.buffer:
+            return
+
+        with self.db:
+            self.db.executemany("INSERT INTO entry VALUES (?, ?, ?, ?, ?)", self.buffer)
+
+        self.buffer = []
+
+        if self.stats:
+            self.stats.add("commit")
+
+    def batches(self, batch = None):
+
+        if batch is not None:
+            return self.db.execute("SELECT id, started, directory FROM batch WHERE id = ?", (batch,)).fetchall()
+
+        return self.db.execute("SELECT id, started, directory FROM batch WHERE undone = 0 ORDER BY id DESC").fetchall()
+
+    def entries(self, batch):
+
+        cursor = self.db.execute("SELECT old, new FROM entry WHERE batch = ? AND ok = 1 ORDER BY seq DESC", (batch,))
+        cursor.arraysize = self.chunk_size
+
+        while True:
+            rows = cursor.fetchmany()
+
+            if not rows:
+                break
+
+            yield from rows
+
+    def mark_undone(self, batch):
+
+        with self.db:
+            self.db.execute("UPDATE batch SET undone = 1 WHERE id = ?", (batch,))
+
+    def replace_entries(self, batch, seq, steps):
+
+        with self.db:
+            self.db.execute("DELETE FROM entry WHERE batch = ? AND seq >= ?", (batch, seq))
+            self.db.executemany("INSERT INTO entry VALUES (?, ?, ?, ?, 1)",
+                                ((batch, seq + i, old, new) for i, (old, new) in enumerate(steps)))
+
+    def summary(self):
+
+        return self.db.execute(
+            "SELECT b.id, b.started, b.directory, "
+            "(SELECT COUNT(*) FROM entry e WHERE e.batch = b.id AND e.ok = 1), b.undone "
+            "FROM batch b ORDER BY b.id").fetchall()
+
+    def close(self):
+
+        try:
+            self.flush()
+
+        finally:
+            self.db.close()
+
+
+
+class WriteAheadLog:
+    """
+    Records the renames of a directory before any of them is done, and every rename as it completes,
+    so a run that is killed half way can be finished or undone by recover_directory
+
+    the file is json lines: a header, the whole plan on one line, then the index of every step done
+    (or !index for a step that failed), the plan is flushed to disk before the first rename,
+    so a plan line cut short means nothing was renamed
+
+    the marks are buffered like the .rn entries and written with the fsync policy, a killed run can lose
+    the newest ones and recover_directory works those out from the files
+
+        __init__(path, fsync, stats)
+        begin(plan, header) : writes the plan, header is where this run starts in the .rn / .rndb journal
+        done(index)         : marks a step of the plan as done
+        failed(index)       : marks a step of the plan as tried and failed
+        flush()             : writes the buffered marks now
+        close()             : writes the buffered marks and closes the file, it is kept so the run can be recovered
+        remove()            : drops the buffered marks and deletes the file once every rename is in the journal
+        read(path)          : (header, plan, set of indexes done, set of indexes failed), or None if the plan was never fully written
+        replace(path, header, plan, done, failed) : swaps the file at path for one with exactly the given marks
+    """
+    def __init__(self, path, *, fsync = "batch", stats = None) -> None:
+
+        self.path = path
+        self.logger = LogWriter(path, "wb", fsync=fsync, stats=stats)
+
+    def begin(self, plan, header):
+
+        self.logger.write(json.dumps(header).encode() + b"\n" + json.dumps(plan).encode() + b"\n")
+        self.logger.flush()
+
+        # the new file is only durable once its directory entry is
+        if self.logger.fsync != "never" and not WINDOWS:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+
+            try:
+                os.fsync(fd)
+
+            finally:
+                os.close(fd)
+
+            if self.logger.stats:
+                self.logger.stats.add("fsync")
+
+    def done(self, index):
+
+        self.logger.write(b"%d\n" % index)
+
+    def flush(self):
+
+        self.logger.flush()
+
+    def failed(self, index):
+
+        self.logger.write(b"!%d\n" % index)
+
+    def close(self):
+
+        if not self.logger.file.closed:
+            self.logger.close()
+
+    def remove(self):
+
+        # the marks of a finished run are never needed
+        self.logger.buffer = []
+        self.close()
+        os.remove(self.path)
+
+        if self.logger.stats:
+            self.logger.stats.add("unlink")
+
+    @staticmethod
+    def read(path):
+
+        with open(path, "rb") as f:
+            lines = f.read().split(b"\n")
+
+        # the last piece has no newline, so it is either empty or was cut short
+        if len(lines) < 3:
+            return None
+
+        try:
+            header = json.loads(lines[0])
+            plan = json.loads(lines[1])
+
+        except ValueError:
+            return None
+
+        done = set()
+        failed = set()
+
+        for line in lines[2:-1]:
+            try:
+                if line.startswith(b"!"):
+                    failed.add(int(line[1:]))
+
+                else:
+                    done.add(int(line))
+
+            except ValueError:
+                pass
+
+        return (header, plan, done, failed)
+
+    @staticmethod
+    def replace(path, header, plan, done, failed):
+
+        temp = path + ".tmp"
+
+        wal = WriteAheadLog(temp, fsync = "never")
+
+        try:
+            wal.begin(plan, header)
+            wal.logger.write(b"".join(b"%d\n" % i for i in sorted(done)) + b"".join(b"!%d\n" % i for i in sorted(failed)))
+            wal.logger.flush()
+            os.fsync(wal.logger.file.fileno())
+
+        finally:
+            wal.close()
+
+        os.replace(temp, path)
+
+
+
+class Renamer:
+    """
+    A simple wrapper around os.rename that handles printing to the console and logging into a file
+    
+        __init__(directory, log_file, overwrite_existing, no_log)
+            - directory : the directory where files are going to be renamed
+            - log_file  : the name of the log file
+            - overwrite_existing : overwrite existing logfile, otherwise appends
+            - no_log : doesn't write anything to the log file
+            - stats  : a SyscallCounter to count the renames and journal writes with
+            - fsync  : when the log file is fsync'd, one of FSYNC_POLICIES
+            - journal : "text" for a .rn file, "sqlite" for a .rndb journal next to it
+            - directory : renames are done relative to this directory instead of the working directory
+            - output : how renames are printed, one of OUTPUT_MODES
+            - wal    : write a .rnwal next to the log file so a killed rename_all can be recovered, ignored with no_log
+
+        errors : list of (file_name, new_name, exception) of every failed rename
+        
+        rename(file_name, new_name) : renames the given file
+            - file_name : the name of the file relative to the given directory from __init__
+            - new_name  : the new name of the file relative to the given directory from __init__
+        rename_all(plan, jobs) : renames every (file_name, new_name) in the plan, returns how many succeeded
+            - plan : list of (file_name, new_name) in the order they should be logged
+            - jobs : the number of threads doing the os.rename calls
+        log(text) : write the given text to the log file
+            - text : bytes / encoded text NOT string -> use string.encode()
+        flush() : writes everything buffered to the log file
+        close() : closes the log file
+    """
+    def __init__(self, log_file, *, sep = "|", overwrite_existing = True, no_log = False, stats = None,
+                 fsync = "batch", output = "normal", journal = "text", directory = None, wal = False) -> None:
+        
+        self.log_file_name = log_file
+        self.directory = directory
+        self.stats = stats
+        self.output = output
+        self.fsync = fsync
+        # nothing is written to disk with no_log, a run without a journal has nothing to recover into anyway
+        self.wal_path = os.path.join(os.path.dirname(log_file), DEFAULT_RN_WAL_FILE) if wal and not no_log else None
+        self.last_progress = 0.0
+
+        # list of (file_name, new_name, exception) of every failed rename
+        self.errors = []
+
+        self.logger = None
+        self.sep = sep
+        self.pad = 50
+
+        if no_log:
+            return
+
+        if journal == "sqlite":
+            _ = os.path.join(os.path.dirname(log_file), DEFAULT_RN_DB_FILE)
+
+            self.logger = SqliteJournal(_, os.path.dirname(os.path.abspath(log_file)), fsync=fsync, stats=stats)
+            return
+
+        # get the path to the rn file
+        _ = log_file
+
+        # if file exists, and the user wants to append logs to existing .rn file, 
+        # read the file and get the separator character,
+        if os.path.exists(_) and not overwrite_existing:
+            with open(_, "r") as fff:
+                self.sep = get_sep(fff.readline())
+
+            self.logger = LogWriter(_, "ab", fsync=fsync, stats=stats)
+
+        # else just override the old file
+        else:
+            # reading / writing as bytes because of foreign characters
+            self.logger = LogWriter(_, "wb", fsync=fsync, stats=stats)
+            self.logger.write(f"sep={self.sep}\n".encode())
+
+    def flush(self):
+        if self.logger:
+            self.logger.flush()
+
+    def journal_position(self):
+        """(journal kind, position) where the entries of the next rename_all start in the log file, see recover_directory"""
+
+        if isinstance(self.logger, SqliteJournal):
+            return ("sqlite", [self.logger.batch, self.logger.seq])
+
+        if self.logger:
+            self.logger.flush()
+            return ("text", self.logger.file.tell())
+
+        return (None, None)
+
+    def close(self):
+        if self.logger:
+            self.logger.close()
+
+    def log(self, text):
+        if not self.logger:
+            return 
+
+        self.logger.write(text)
+
+    def log_rename(self, file_name, new_name, ok):
+        if not self.logger:
+            return
+
+        if isinstance(self.logger, SqliteJournal):
+            self.logger.add(file_name, new_name, ok)
+
+        elif ok:
+            self.log(f"{file_name}{self.sep}{new_name}\n".encode())
+
+        else:
+            self.log(f"ERROR{self.sep}{file_name}{self.sep}{new_name}\n".encode())
+
+    def try_rename(self, file_name, new_name):
+        """
+        Does the os.rename and returns the exception instead of raising it, safe to call from any thread,
+        a file that already has the new name is never replaced, FileExistsError is returned instead
+        """
+
+        if self.directory is not None:
+            file_name = os.path.join(self.directory, file_name)
+            new_name = os.path.join(self.directory, new_name)
+
+        try:
+            # os.rename replaces an existing file on posix (windows refuses), a file that is there is never renamed over,
+            # unless it is the file itself, a case only rename on a case insensitive filesystem
+            if not WINDOWS:
+                if self.stats:
+                    self.stats.add("stat")
+
+                try:
+                    target = os.lstat(new_name)
+
+                except FileNotFoundError:
+                    target = None
+
+                if target is not None and not os.path.samestat(target, os.lstat(file_name)):
+                    return FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), new_name)
+
+            os.rename(file_name, new_name)
+
+        except Exception as e:
+            return e
+
+        return None
+
+    def report(self, file_name, new_name, error):
+        """Prints and logs the result of a rename, returns if the rename succeeded"""
+
+        if self.stats:
+            self.stats.add("rename")
+
+        if error is None:
+            self.log_rename(file_name, new_name, True)
+
+            if self.output == "normal":
+                print('   {0:<{1}} {2}-->{4} {3}'.format(file_name, self.pad, OKGREEN, new_name, ENDC))
+
+            return True
+
+        self.log_rename(file_name, new_name, False)
+        self.errors.append((file_name, new_name, error))
+
+        if self.output == "silent":
+            return False
+
+        if self.output == "progress":
+            print()
+
+        # in quiet mode there is no directory header, so show where the file is
+        if self.output != "normal" and self.directory is not None:
+            file_name = os.path.join(self.directory, file_name)
+        
+        print('   {0:<{1}} {2}-->{4} {3}'.format(file_name, self.pad, FAIL, getattr(error, 'message', repr(error)), ENDC))
+
+        return False
+
+    def progress(self, done, total):
+        """Redraws the progress bar at most every 0.1 seconds, and always on the last file"""
+
+        now = time.perf_counter()
+
+        if done != total and now - self.last_progress < 0.1:
+            return
+
+        self.last_progress = now
+
+        width = 40
+        fill = width * done // total if total else width
+
+        print("\r   [{0}{1}] {2}/{3}".format("#" * fill, " " * (width - fill), done, total),
+              end="\n" if done == total else "", flush=True)
+
+    def rename(self, file_name, new_name):
+
+        return self.report(file_name, new_name, self.try_rename(file_name, new_name))
+
+    def rename_all(self, plan, jobs = 1):
+
+        if not plan:
+            return 0
+
+        # a rename onto a name that another entry is renaming away from depends on the order, so keep it sequential
+        if jobs > 1:
+            sources = set(old for old, _ in plan)
+
+            if any(new in sources and new != old for old, new in plan):
+                jobs = 1
+
+        total = len(plan)
+        renamed = 0
+        wal = None
+
+        if self.wal_path:
+            (kind, position) = self.journal_position()
+
+            wal = WriteAheadLog(self.wal_path, fsync = self.fsync, stats = self.stats)
+            wal.begin(plan, {"journal" : kind, "position" : position, "sep" : self.sep})
+
+        key = os.path.normcase
+
+        # the names used by every step that failed, a step using one of them depends on a failed step and is skipped,
+        # ex: a->b, b->c is done as b->c then a->b, and a->b must not run when b->c failed
+        blocked = set()
+
+        # a step moving a file to a name that a later step renames again (the temporary name of a cycle) leaves the
+        # names looking as if nothing was done once the cycle is finished, so its mark is written before going on
+        first_use = {}
+
+        for i, (old, _) in enumerate(plan):
+            first_use.setdefault(key(old), i)
+
+        reused = set(i for i, (_, new) in enumerate(plan) if first_use.get(key(new), -1) > i)
+
+        def run(old, new):
+
+            if key(old) in blocked or key(new) in blocked:
+                return OSError(errno.ECANCELED, "skipped, it depends on a rename that failed")
+
+            return self.try_rename(old, new)
+
+        if jobs <= 1:
+            results = (run(old, new) for old, new in plan)
+
+        else:
+            # importing concurrent.futures pulls in logging, so it is only done when threads are used
+            from concurrent.futures import ThreadPoolExecutor
+
+            pool = ThreadPoolExecutor(max_workers=jobs)
+
+            # map yields in submission order so the .rn file and output stay in plan order
+            results = pool.map(self.try_rename, *zip(*plan))
+
+        try:
+            for done, ((old, new), error) in enumerate(zip(plan, results), 1):
+
+                if self.report(old, new, error):
+                    renamed += 1
+
+                    if wal:
+                        wal.done(done - 1)
+
+                else:
+                    blocked.update((key(old), key(new)))
+
+                    if wal:
+                        wal.failed(done - 1)
+
+                if wal and done - 1 in reused:
+                    wal.flush()
+
+                if self.output == "progress":
+                    self.progress(done, total)
+
+        except BaseException:
+            # the run is cut short, its marks are written so it can be recovered
+            if wal:
+                wal.close()
+
+            raise
+
+        finally:
+            if jobs > 1:
+                pool.shutdown()
+
+        # the plan is only thrown away once every rename is in the journal
+        if wal:
+            self.flush()
+            wal.remove()
+
+        return renamed
+            
+
+
+
+def plan_entries(entries, names, template, replace, file_filter, stats = None, *, hasher = None, meta_reader = None,
+                 invalid = RM_INVALID):
+    """
+    Builds the new names of the given files of a single directory without renaming or printing anything,
+    returns (steps, collisions) from plan_renames
+
+        - entries  : the FileEntry to rename
+        - names    : every name in the directory, new names must not collide with these
+        - invalid  : the re.sub that replaces the invalid path characters, see RESTRICT_MAP
+        - the other arguments are the same as rename_directory
+    """
+    entries = sorted(entries, key=lambda x : natural_sort_key(x.name))
+    entries = [i for i in entries if file_filter(i.name)]
+
+    # hash every file of the directory at once so the process pool is kept busy
+    if hasher and entries:
+        hasher.hash_entries(entries)
+
+    if meta_reader and entries:
+        meta_reader.read_entries(entries)
+
+    # list of (file, new name) built before anything is renamed
+    plan = []
+
+    for entry in entries:
+
+        file = entry.name
+        
+        n_file = file
+
+        if stats:
+            stats.add_file()
+
+        if template:
+
+            n_file = template.render(entry)
+
+
+        n_file = replace(n_file)
+
+
+        n_file = invalid(REPLACE_INVALID, n_file)
+
+        plan.append((file, n_file))
+
+    return plan_renames(plan, names)
+
+
+
+def rename_entries(renamer, entries, names, args, template, replace, file_filter, stats = None, *, jobs = 1, output = "normal",
+                   hasher = None, meta_reader = None):
+    """
+    Renames the given files of a single directory with an open Renamer,
+    returns (the number of files renamed, the list of (old, new) renames planned)
+
+        - renamer  : the Renamer of the directory
+        - entries  : the FileEntry to rename
+        - names    : every name in the directory, new names must not collide with these
+        - the other arguments are the same as rename_directory
+    """
+    if entries:
+        renamer.pad = len(max(entries, key=lambda x : len(x.name)).name)
+
+    (steps, collisions) = plan_entries(entries, names, template, replace, file_filter, stats,
+                                       hasher = hasher, meta_reader = meta_reader)
+
+    if collisions:
+
+        for old, new in collisions:
+            print('   {0:<{1}} {2}--> {3} already exists or is used twice{4}'.format(old, renamer.pad, FAIL, new, ENDC))
+
+        print("{0}Name collisions found, nothing in {1} was renamed{2}".format(FAIL, renamer.directory, ENDC))
+
+        return (0, [])
+
+    if args.dry_run:
+
+        for old, new in steps:
+            print('   {0:<{1}} {2}-->{4} {3}'.format(os.path.join(renamer.directory, old) if output != "normal" else old, renamer.pad, OKCYAN, new, ENDC))
+
+        return (0, steps)
+
+    return (renamer.rename_all(steps, jobs), steps)
+
+
+
+def rename_directory(dir, args, template, replace, file_filter, stats = None, *, scanned = None, reset = True, jobs = None, output = None,
+                     hasher = None, meta_reader = None):
+    """
+    Renames the files of a single directory and writes its .rn file, returns the number of files renamed
+
+        - dir      : the absolute path of the directory
+        - args     : the parsed command line options
+        - template : the compiled -f format or None
+        - replace  : the Replacer built from the replace options
+        - file_filter : the FileFilter built from the filter options
+        - stats    : a SyscallCounter or None
+        - scanned  : (dir, entries, names) from scan_tree, otherwise the directory is scanned here
+        - reset    : reset the template counters before the first file
+        - jobs / output : override args.jobs / args.output
+        - hasher   : a ContentHasher when the template uses $[SHA1] / $[XXH] ...
+        - meta_reader : a MetadataReader when the template uses $[WIDTH] / $[EXIF:...] ...
+    """
+    jobs = args.jobs if jobs is None else jobs
+    output = args.output if output is None else output
+
+    if template and reset:
+        template.reset()
+
+    if output == "normal":
+        print("{0}{1}:{2}".format(WARNING, dir, ENDC))
+
+    recovered = False
+
+    try:
+        if scanned is None:
+            names = set()
+            entries = list(scan_directory(dir, stats, names))
+
+        else:
+            (_, entries, names) = scanned
+
+        # a killed run left its plan behind, it is finished or undone before the .rn file is opened again
+        if DEFAULT_RN_WAL_FILE in names and not args.dry_run:
+            try:
+                recover_directory(dir, args.recover, output)
+
+            except FileExistsError as e:
+                if output != "silent":
+                    print("{0}{1}: {2}{3}".format(FAIL, dir, e, ENDC))
+
+                return 0
+
+            recovered = True
+
+            names = set()
+            entries = list(scan_directory(dir, stats, names))
+
+    except OSError as e:
+        if output != "silent":
+            print("{0}Could not list {1}: {2}{3}".format(FAIL, dir, e, ENDC))
+
+        return 0
+
+    # the journal a recovery just rewrote holds the renames of the killed run, so it is appended to
+    renamer = Renamer(os.path.join(dir, DEFAULT_RN_FILE), 
+                      sep = args.sep,
+                      overwrite_existing = not args.append_rn_data and not recovered, 
+                      no_log = args.no_rn_file or args.dry_run,
+                      stats = stats,
+                      fsync = args.fsync,
+                      output = output,
+                      journal = args.journal,
+                      directory = dir,
+                      wal = not args.dry_run and not args.no_wal)
+
+    try:
+        return rename_entries(renamer, entries, names, args, template, replace, file_filter, stats,
+                              jobs = jobs, output = output, hasher = hasher, meta_reader = meta_reader)[0]
+
+    except OSError as e:
+        if output != "silent":
+            print("{0}Could not rename the files of {1}: {2}{3}".format(FAIL, dir, e, ENDC))
+
+        return 0
+
+    finally:
+        # close our log file
+        renamer.close()
+
+
+
+class WatchSession:
+    """
+    Keeps the renamer running and renames the new files of the watched directories as they show up,
+    only the files named by an event are looked at instead of rescanning the directories
+
+    the templates (and their $[n:z] counters) and the .rn journal of every directory stay open between events
+
+        __init__(args, template_format, replace, file_filter, stats, hasher, meta_reader)
+            - the arguments are the same as rename_directory, template_format is the -f format
+        add(directory) : renames the files already in the directory and starts watching it (and its sub directories with -R)
+        update(directory, names) : renames the given names of the directory that are new, None rescans the directory
+        run()   : renames files as events come in until interrupted (ctrl+c)
+        close() : closes every journal and the watcher
+
+        renamed : the number of files renamed so far
+    """
+    def __init__(self, args, template_format, replace, file_filter, stats = None, *, hasher = None, meta_reader = None) -> None:
+
+        self.args = args
+        self.template_format = template_format
+        self.replace = replace
+        self.file_filter = file_filter
+        self.stats = stats
+        self.hasher = hasher
+        self.meta_reader = meta_reader
+
+        # only --watch needs the watcher, and it is found next to this file only when run as a script
+        from watch import get_watcher, DEFAULT_POLL_INTERVAL
+
+        self.watcher = get_watcher(polling = args.poll,
+                                   interval = DEFAULT_POLL_INTERVAL if args.poll_interval is None else args.poll_interval)
+        self.renamed = 0
+
+        # directory -> every name in it, so the names made by our own renames are not renamed again
+        self.known = {}
+
+        # directories whose journal was rewritten by a recovery, it is appended to instead of overwritten
+        self.recovered = set()
+
+        # directory -> Renamer / Template
+        self.renamers = {}
+        self.templates = {}
+
+        # a global counter keeps counting across every directory
+        self.template = compile_template(template_format) if template_format and args.counter == "global" else None
+
+    def get_renamer(self, dir):
+
+        if dir not in self.renamers:
+            self.renamers[dir] = Renamer(os.path.join(dir, DEFAULT_RN_FILE),
+                                         sep = self.args.sep,
+                                         overwrite_existing = not self.args.append_rn_data and dir not in self.recovered,
+                                         no_log = self.args.no_rn_file or self.args.dry_run,
+                                         stats = self.stats,
+                                         fsync = self.args.fsync,
+                                         output = self.args.output,
+                                         journal = self.args.journal,
+                                         directory = dir,
+                                         wal = not self.args.dry_run and not self.args.no_wal)
+
+        return self.renamers[dir]
+
+    def get_template(self, dir):
+
+        if not self.template_format or self.template:
+            return self.template
+
+        if dir not in self.templates:
+            self.templates[dir] = compile_template(self.template_format)
+
+        return self.templates[dir]
+
+    def process(self, dir, entries, names):
+
+        if self.args.output == "normal" and entries:
+            print("{0}{1}:{2}".format(WARNING, dir, ENDC))
+
+        renamer = self.get_renamer(dir)
+
+        (renamed, steps) = rename_entries(renamer, entries, names, self.args, self.get_template(dir), self.replace, self.file_filter,
+                                          self.stats, jobs = self.args.jobs, output = self.args.output,
+                                          hasher = self.hasher, meta_reader = self.meta_reader)
+
+        # the journal is kept open, but what was renamed should be on disk before waiting for the next event
+        renamer.flush()
+
+        self.renamed += renamed
+
+        known = self.known[dir]
+
+        for name in set(i.name for i in entries).union(new for _, new in steps):
+
+            if os.path.lexists(os.path.join(dir, name)):
+                known.add(name)
+
+            else:
+                known.discard(name)
+
+    def add(self, dir):
+
+        if dir in self.known:
+            return
+
+        # watch before scanning so a file created during the scan is not missed
+        try:
+            self.watcher.add(dir)
+
+        except OSError as e:
+            print("{0}Could not watch {1}: {2}{3}".format(FAIL, dir, e, ENDC))
+            return
+
+        self.update(dir, None)
+
+    def update(self, dir, names):
+
+        if names is None:
+            dirs = []
+            all_names = set()
+
+            if dir not in self.renamers and not self.args.dry_run and os.path.lexists(os.path.join(dir, DEFAULT_RN_WAL_FILE)):
+                try:
+                    self.renamed += recover_directory(dir, self.args.recover, self.args.output)
+
+                except FileExistsError as e:
+                    print("{0}{1}: {2}{3}".format(FAIL, dir, e, ENDC))
+                    return
+
+                self.recovered.add(dir)
+
+            try:
+                entries = list(scan_directory(dir, self.stats, all_names, dirs))
+
+            except OSError:
+                return
+
+            # the listing replaces what was known, the files not known before are new
+            known = self.known.get(dir, set())
+            self.known[dir] = set(all_names)
+
+            self.process(dir, [i for i in entries if i.name not in known], all_names)
+
+            if self.args.recursive:
+                for i in sorted(dirs, key=natural_sort_key):
+                    self.add(i)
+
+            return
+
+        known = self.known.get(dir)
+
+        if known is None:
+            return
+
+        entries = []
+
+        for name in names:
+
+            path = os.path.join(dir, name)
+
+            try:
+                st = os.stat(path, follow_symlinks=False)
+
+            except OSError:
+                known.discard(name)
+                continue
+
+            if name in known or name in JOURNAL_FILES:
+                continue
+
+            known.add(name)
+
+            if os.path.isdir(path) and not os.path.islink(path):
+
+                if self.args.recursive:
+                    self.add(path)
+
+                continue
+
+            if self.stats:
+                self.stats.add("stat")
+
+            entries.append(FileEntry.from_path(path, st, self.stats))
+
+        if entries:
+            self.process(dir, entries, known)
+
+    def run(self):
+
+        try:
+            while True:
+                for dir, names in self.watcher.read().items():
+                    self.update(dir, names)
+
+        except KeyboardInterrupt:
+            pass
+
+    def close(self):
+
+        for renamer in self.renamers.values():
+            renamer.close()
+
+        self.watcher.close()
+
+
+
+
+class DirectoryPlan:
+    """
+    The renames planned for a single directory by RenameJob.plan
+
+        directory  : the absolute path of the directory
+        renames    : list of (old name, new name) in the order they are done, chains and cycles go through temporary names
+        collisions : list of (old name, new name) that would overwrite another file, nothing in the directory is renamed when not empty
+    """
+    __slots__ = ("directory", "renames", "collisions")
+
+    def __init__(self, directory, renames, collisions) -> None:
+        self.directory = directory
+        self.renames = renames
+        self.collisions = collisions
+
+
+
+class RenameResult:
+    """
+    What RenameJob.apply did
+
+        renamed    : list of (directory, old name, new name) of every rename done
+        failed     : list of (directory, old name, new name, exception) of every rename that failed
+        collisions : list of (directory, old name, new name) of the directories skipped because of name collisions
+    """
+    __slots__ = ("renamed", "failed", "collisions")
+
+    def __init__(self) -> None:
+        self.renamed = []
+        self.failed = []
+        self.collisions = []
+
+
+
+class UndoResult:
+    """
+    What RenameJob.undo did
+
+        restored / skipped / failed : the number of files renamed back, no longer there, and that could not be renamed back
+        errors : list of (path, old name, exception) of the failed files, old name is None when the journal could not be read
+    """
+    __slots__ = ("restored", "skipped", "failed", "errors")
+
+    def __init__(self, counts, errors) -> None:
+        self.restored = counts["restored"]
+        self.skipped = counts["skipped"]
+        self.failed = counts["failed"]
+        self.errors = errors
+
+
+
+class RenameJob:
+    """
+    Renames files from python without going through the command line,
+    nothing is printed, the working directory is never changed and paths are made absolute
+
+        __init__(inputs, format, ...) : the options are the same as the command line ones
+            - inputs  : list of directories
+            - format  : the -f format or None
+            - replace : dict of text -> replacement (-r)
+            - replace_regex : list of (pattern, replacement) (-rr)
+            - matches / start_with / ends_with / globs / excludes : the filter options
+            - recursive : also rename the files of every sub directory
+            - counter   : "per-dir" or "global", when the $[n:z] counters restart
+            - restrict  : which characters are invalid in the new names, a key of RESTRICT_MAP
+            - journal   : "text" / "sqlite" for a .rn / .rndb file in every directory, or None for no journal
+            - append_journal : append to existing .rn files instead of overwriting them
+            - sep / fsync / jobs : the same as --sep / --fsync / --jobs
+            - wal / recover : write a .rnwal plan before renaming, and what is done with the .rnwal of a killed run (RECOVER_MODES)
+            - hash_jobs / hash_cache / metadata_cache : the same as --hash-jobs / --hash-cache / --metadata-cache,
+                                                        True uses the default file and None disables a cache
+
+        recover() : finishes or undoes (recover) the runs that were killed in the directories, returns the number of files renamed
+        plan()  : returns a list of DirectoryPlan, the new names are built but nothing is renamed,
+                  a directory holding the .rnwal of a killed run is left out until recover() is called
+        apply(plans) : does the renames of plan(), when plans is None recover() and plan() are called here, returns a RenameResult
+        undo(journals, batch, recursive) : renames the files of the given .rn / .rndb files or directories back, returns an UndoResult
+        close() : stops the hash pool and closes the caches, also done when used as a context manager
+    """
+    def __init__(self, inputs, format = None, *, replace = None, replace_regex = (),
+                 matches = (), start_with = (), ends_with = (), globs = (), excludes = (),
+                 recursive = False, counter = "per-dir", restrict = "auto",
+                 journal = "text", append_journal = False, sep = DEFAULT_SEP, fsync = "batch", jobs = 1,
+                 wal = True, recover = "forward",
+                 hash_jobs = None, hash_cache = True, metadata_cache = True) -> None:
+
+        if journal not in JOURNAL_FORMATS and journal is not None:
+            raise ValueError(f"journal must be one of {JOURNAL_FORMATS} or None, given: {journal}")
+
+        self.directories = [os.path.abspath(i) for i in inputs]
+        self.format = format
+        self.recursive = recursive
+        self.counter = counter
+        self.journal = journal
+        self.append_journal = append_journal
+        self.sep = sep
+        self.fsync = fsync
+        self.jobs = jobs
+        self.wal = wal
+        self.recover_mode = recover
+
+        # directories whose journal was rewritten by a recovery, it is appended to instead of overwritten
+        self.recovered = set()
+
+        self.replace = Replacer(replace, replace_regex)
+        self.file_filter = FileFilter(matches, start_with, ends_with, globs, excludes)
+        self.invalid = compile(f"[{RESTRICT_MAP[restrict]}]").sub
+
+        self.template = compile_template(format) if format else None
+        self.hasher = None
+        self.meta_reader = None
+
+        if self.template and self.template.hash_algorithms:
+            from content_hash import ContentHasher, HashCache, DEFAULT_CACHE_FILE
+
+            if hash_cache is True:
+                hash_cache = DEFAULT_CACHE_FILE
+
+            self.hasher = ContentHasher(self.template.hash_algorithms, jobs = hash_jobs,
+                                        cache = HashCache(hash_cache) if hash_cache else None)
+
+        if self.template and self.template.needs_metadata:
+            from media_metadata import MetadataReader, MetadataCache, DEFAULT_METADATA_CACHE_FILE
+
+            if metadata_cache is True:
+                metadata_cache = DEFAULT_METADATA_CACHE_FILE
+
+            self.meta_reader = MetadataReader(cache = MetadataCache(metadata_cache) if metadata_cache else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def scan(self):
+        """Yields (directory, entries, names) of every directory to rename"""
+
+        for dir in self.directories:
+
+            for scanned in scan_tree(dir) if self.recursive else self.scan_one(dir):
+
+                # the files of a killed run are half renamed, a plan made from them would be wrong
+                if DEFAULT_RN_WAL_FILE not in scanned[2]:
+                    yield scanned
+
+    def recover(self):
+
+        renamed = 0
+
+        for root in self.directories:
+
+            for dir, _, names in scan_tree(root) if self.recursive else self.scan_one(root):
+
+                if DEFAULT_RN_WAL_FILE in names:
+                    renamed += recover_directory(dir, self.recover_mode, "silent")
+                    self.recovered.add(dir)
+
+        return renamed
+
+    def scan_one(self, dir):
+
+        names = set()
+
+        try:
+            entries = list(scan_directory(dir, None, names))
+
+        except OSError:
+            return ()
+
+        return ((dir, entries, names),)
+
+    def plan(self):
+
+        plans = []
+
+        if self.template and self.counter == "global":
+            self.template.reset()
+
+        for dir, entries, names in self.scan():
+
+            if self.template and self.counter != "global":
+                self.template.reset()
+
+            (steps, collisions) = plan_entries(entries, names, self.template, self.replace, self.file_filter,
+                                               hasher = self.hasher, meta_reader = self.meta_reader, invalid = self.invalid)
+
+            plans.append(DirectoryPlan(dir, steps, collisions))
+
+        return plans
+
+    def apply(self, plans = None):
+
+        if plans is None:
+            self.recover()
+            plans = self.plan()
+
+        result = RenameResult()
+
+        for plan in plans:
+
+            if plan.collisions:
+                result.collisions.extend((plan.directory, old, new) for old, new in plan.collisions)
+                continue
+
+            if not plan.renames:
+                continue
+
+            renamer = Renamer(os.path.join(plan.directory, DEFAULT_RN_FILE),
+                              sep = self.sep,
+                              overwrite_existing = not self.append_journal and plan.directory not in self.recovered,
+                              no_log = self.journal is None,
+                              fsync = self.fsync,
+                              output = "silent",
+                              journal = self.journal or "text",
+                              directory = plan.directory,
+                              wal = self.wal)
+
+            try:
+                renamer.rename_all(plan.renames, self.jobs)
+
+            finally:
+                renamer.close()
+
+            failed = set((old, new) for old, new, _ in renamer.errors)
+
+            result.renamed.extend((plan.directory, old, new) for old, new in plan.renames if (old, new) not in failed)
+            result.failed.extend((plan.directory, old, new, e) for old, new, e in renamer.errors)
+
+        return result
+
+    def undo(self, journals = None, batch = None, *, recursive = None):
+
+        errors = []
+        counts = undo_journals(find_journals(journals or self.directories, self.recursive if recursive is None else recursive),
+                               batch, jobs = self.jobs, output = "silent", errors = errors)
+
+        return UndoResult(counts, errors)
+
+    def close(self):
+
+        if self.hasher:
+            self.hasher.close()
+            self.hasher = None
+
+        if self.meta_reader:
+            self.meta_reader.close()
+            self.meta_reader = None
+
+
+
+def main(_args = None):
+    """Runs the renamer with the given command line arguments (sys.argv when None), returns (files renamed, SyscallCounter or None)"""
+
+    parser = get_parser()
+    args = parser.parse_args(_args)
+
+    if args.display_formats:
+        print(FORMAT_HELP_MESSAGE)
+        return
+
+    if args.custom_date_formats:
+        print(DATE_FORMAT_HELP_MESSAGE.decode())
+        return 
+
+    if args.list_batches:
+        list_journal_batches(args.list_batches)
+        return
+
+    if args.undo_file:
+        handle_undo(args.undo_file, args.undo_batch, recursive = args.recursive, jobs = args.jobs, output = args.output)
+        return
+
+    if not args.inputs:
+        parser.error("No inputs specified")
+        return 
+
+    if not args.format and not args.replace and not args.replace_regex and not args.replace_file:
+        print("No output format or replace specified use -f \"FORMAT\" to specify a format --format-help for more info\nor -r 'word:replacement' to replace words")
+        return
+
+    
+    _replace = {} 
+    _replace_regex = []
+    _format  = args.format
+
+    # directories to rename
+    _directories = set()
+
+    _stats = SyscallCounter() if args.stats else None
+
+    try:
+        _filter = FileFilter(args.matches, args.start_with, args.ends_with, args.globs, args.excludes)
+
+    except re_error as e:
+        parser.error(f"invalid --match regex: {e}")
+
+
+
+    if args.replace:                  # replace specified
+
+        for i in args.replace:        # go through all given strings
+            
+            _ = i.rsplit(":", 1)      # split at last occurance of :
+            
+            if len(_) == 2:           # if there is not 2 items skip
+                _replace[_[0]] = _[1] # set dict 
+
+    if args.replace_regex:
+
+        for i in args.replace_regex:
+
+            _ = i.rsplit(":", 1)
+
+            if len(_) == 2:
+                _replace_regex.append((_[0], _[1]))
+
+    if args.replace_file:
+
+        for i in args.replace_file:
+
+            for key, value in read_replace_file(i):
+                _replace[key] = value
+
+    try:
+        _replace = Replacer(_replace, _replace_regex)
+
+    except (ValueError, re_error) as e:
+        parser.error(str(e))
+
+
+    for i in args.inputs:
+
+        if not os.path.exists(i):
+            continue
+
+        if os.path.isdir(i):
+            _directories.add(os.path.abspath(i))
+
+
+    
+    renamed = 0
+    start_time = time.perf_counter()
+
+    template = compile_template(_format) if _format else None
+    hasher = None
+
+    if template and template.hash_algorithms:
+
+        # hashing and reading metadata pull in their own modules, so they are only imported when the format needs them
+        from content_hash import ContentHasher, HashCache, DEFAULT_CACHE_FILE
+
+        try:
+            hasher = ContentHasher(template.hash_algorithms, jobs = args.hash_jobs,
+                                   cache = None if args.no_hash_cache else HashCache(args.hash_cache or DEFAULT_CACHE_FILE))
+
+        except ImportError as e:
+            parser.error(str(e))
+
+    meta_reader = None
+
+    if template and template.needs_metadata:
+        from media_metadata import MetadataReader, MetadataCache, DEFAULT_METADATA_CACHE_FILE
+
+        meta_reader = MetadataReader(cache = None if args.no_metadata_cache else MetadataCache(args.metadata_cache or DEFAULT_METADATA_CACHE_FILE))
+
+    try:
+        if args.watch:
+
+            session = WatchSession(args, _format, _replace, _filter, _stats, hasher = hasher, meta_reader = meta_reader)
+
+            try:
+                for dir in sorted(_directories, key=natural_sort_key):
+                    session.add(dir)
+
+                print("{0}Watching {1} directories, ctrl+c to stop{2}".format(OKCYAN, len(session.known), ENDC))
+
+                session.run()
+
+            finally:
+                session.close()
+
+            renamed = session.renamed
+
+        elif not args.recursive:
+
+            for dir in _directories:
+
+                renamed += rename_directory(dir, args, template, _replace, _filter, _stats, hasher = hasher,
+                                            meta_reader = meta_reader)
+
+        elif args.counter == "global" or args.jobs <= 1:
+
+            # a global counter continues through the directories in the order they are walked
+            for dir in _directories:
+
+                for scanned in scan_tree(dir, _stats):
+
+                    renamed += rename_directory(scanned[0], args, template, _replace, _filter, _stats,
+                                                scanned = scanned, reset = args.counter == "per-dir", hasher = hasher,
+                                                meta_reader = meta_reader)
+
+        else:
+
+            # output from several directories at once would interleave, so only print errors
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+
+                # every directory gets its own template so the counters are independent
+                futures = [pool.submit(rename_directory, scanned[0], args, compile_template(_format) if _format else None,
+                                       _replace, _filter, _stats, scanned = scanned, jobs = 1, output = "quiet", hasher = hasher,
+                                       meta_reader = meta_reader)
+                           for dir in _directories
+                           for scanned in scan_tree(dir, _stats)]
+
+                for future in futures:
+                    renamed += future.result()
+
+    finally:
+        if hasher:
+            hasher.close()
+
+        if meta_reader:
+            meta_reader.close()
+
+    if hasher:
+        print(hasher.summary())
+
+    if meta_reader:
+        print(meta_reader.summary())
+
+    if args.jobs > 1 or _stats:
+        elapsed = time.perf_counter() - start_time
+        rate = renamed / elapsed if elapsed > 0 else 0
+
+        print(f"renamed {renamed} files in {elapsed:.2f}s ({rate:.0f} renames/s)")
+
+    if _stats:
+        print(_stats.summary())
 
+    return (renamed, _stats)
 
 
 
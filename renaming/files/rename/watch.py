@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import struct
+import select
+
+
+# inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len, then len bytes of name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+
+# a file is only reported once it is closed after writing or moved in, so half written files are left alone
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class InotifyWatcher:
+    """
+    Watches directories with inotify (linux only), through ctypes so nothing needs to be installed
+
+        add(directory) : start watching the given directory
+        read(timeout)  : waits for events, returns a dict of directory -> set of names that changed,
+                         the set is None when events were lost and the directory needs a full rescan
+        close()        : stops watching
+    """
+    def __init__(self, directories = ()) -> None:
+
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # watch descriptor -> directory
+        self.watches = {}
+
+        for i in directories:
+            self.add(i)
+
+    def add(self, directory):
+
+        import ctypes
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"could not watch {directory}")
+
+        self.watches[wd] = directory
+
+    def read(self, timeout = None):
+
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+
+        if not ready:
+            return {}
+
+        data = os.read(self.fd, 1 << 16)
+        changed = {}
+        offset = 0
+
+        while offset + INOTIFY_EVENT.size <= len(data):
+
+            (wd, mask, _, length) = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\x00"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                return {i : None for i in self.watches.values()}
+
+            if wd not in self.watches:
+                continue
+
+            directory = self.watches[wd]
+
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                del self.watches[wd]
+                continue
+
+            # only new directories are wanted from IN_CREATE, new files wait for IN_CLOSE_WRITE
+            if mask & IN_CREATE and not mask & IN_ISDIR:
+                continue
+
+            names = changed.setdefault(directory, set())
+
+            if names is not None:
+                names.add(name)
+
+        return changed
+
+    def close(self):
+
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Watches directories by listing them every interval, used where inotify is missing
+
+    a new file is only reported once its size is the same on two polls in a row, so half written files are left alone
+
+        add(directory) : start watching the given directory
+        read(timeout)  : sleeps until the next poll, returns a dict of directory -> set of names that changed
+        close()        : stops watching
+    """
+    def __init__(self, directories = (), *, interval = DEFAULT_POLL_INTERVAL) -> None:
+
+        self.interval = interval
+
+        # directory -> {name : size}
+        self.listings = {}
+
+        # directory -> {name : size} of new files not reported yet
+        self.pending = {}
+
+        for i in directories:
+            self.add(i)
+
+    def list(self, directory):
+
+        listing = {}
+
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        listing[entry.name] = -1 if entry.is_dir() else entry.stat().st_size
+
+                    except OSError:
+                        pass
+
+        except OSError:
+            return None
+
+        return listing
+
+    def add(self, directory):
+
+        self.listings[directory] = self.list(directory) or {}
+        self.pending[directory] = {}
+
+    def read(self, timeout = None):
+
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+
+        changed = {}
+
+        for directory in list(self.listings):
+
+            listing = self.list(directory)
+
+            if listing is None:
+                del self.listings[directory]
+                del self.pending[directory]
+                continue
+
+            old = self.listings[directory]
+            pending = self.pending[directory]
+            names = set(old) - set(listing)
+
+            for name, size in listing.items():
+
+                if name in old and name not in pending:
+                    continue
+
+                if pending.get(name) == size:
+                    del pending[name]
+                    names.add(name)
+
+                else:
+                    pending[name] = size
+
+            for name in list(pending):
+                if name not in listing:
+                    del pending[name]
+
+            self.listings[directory] = listing
+
+            if names:
+                changed[directory] = names
+
+        return changed
+
+    def close(self):
+
+        self.listings.clear()
+        self.pending.clear()
+
+
+def get_watcher(directories = (), *, polling = False, interval = DEFAULT_POLL_INTERVAL):
+    """An InotifyWatcher on linux, otherwise (or when polling is True) a PollingWatcher"""
+
+    if not polling and sys.platform.startswith("linux"):
+
+        try:
+            return InotifyWatcher(directories)
+
+        except (OSError, AttributeError):
+            pass
+
+    return PollingWatcher(directories, interval = interval)
@@ -0,0 +1,262 @@
+import os
+import mmap
+import time
+import hashlib
+import threading
+
+try:
+    import xxhash
+    XXHASH_NOT_FOUND = False
+
+except ImportError:
+    XXHASH_NOT_FOUND = True
+
+
+# the bytes handed to the hash function at a time
+HASH_CHUNK_SIZE = 1 << 20
+
+# below this many files the process pool is not worth starting
+MIN_POOL_FILES = 8
+
+HASH_ALGORITHMS = ("SHA1", "SHA256", "MD5", "XXH")
+
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "py-scripts", "rename_hashes.db")
+
+
+def new_hash(algorithm):
+
+    if algorithm == "XXH":
+
+        if XXHASH_NOT_FOUND:
+            raise ImportError("$[XXH] needs the xxhash module -> pip install xxhash")
+
+        return xxhash.xxh64()
+
+    return hashlib.new(algorithm.lower())
+
+
+def hash_file(path, algorithms):
+    """Hashes the file with every given algorithm in a single read through an mmap, returns a dict of algorithm -> hex digest"""
+
+    hashes = [new_hash(i) for i in algorithms]
+
+    with open(path, "rb") as f:
+
+        size = os.fstat(f.fileno()).st_size
+
+        # an empty file cannot be mapped
+        if size > 0:
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+
+                view = memoryview(m)
+
+                try:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+
+                        chunk = view[offset:offset + HASH_CHUNK_SIZE]
+
+                        for h in hashes:
+                            h.update(chunk)
+
+                        chunk.release()
+
+                finally:
+                    view.release()
+
+    return {a : h.hexdigest() for a, h in zip(algorithms, hashes)}
+
+
+def _hash_worker(path, algorithms):
+    """Runs in the process pool, returns (path, hashes)"""
+
+    return (path, hash_file(path, algorithms))
+
+
+class HashCache:
+    """
+    A persistent (path, size, mtime, algorithm) -> hash cache stored in sqlite,
+    a file whose size or mtime changed is simply a cache miss
+
+        get(path, size, mtime, algorithms) : dict of algorithm -> hash, or None if any is missing
+        put(files)                         : store a list of (path, size, mtime, hashes) in one transaction
+        close()                            : commit and close the database
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS hash (
+        path      TEXT NOT NULL,
+        size      INTEGER NOT NULL,
+        mtime     INTEGER NOT NULL,
+        algorithm TEXT NOT NULL,
+        digest    TEXT NOT NULL,
+        PRIMARY KEY (path, algorithm)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path = DEFAULT_CACHE_FILE) -> None:
+
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # the renamer can hash several directories from different threads
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, path, size, mtime, algorithms):
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT algorithm, digest FROM hash WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime)).fetchall()
+
+        found = dict(rows)
+
+        if all(a in found for a in algorithms):
+            return {a : found[a] for a in algorithms}
+
+        return None
+
+    def put(self, files):
+
+        rows = [(path, size, mtime, a, d) for path, size, mtime, hashes in files for a, d in hashes.items()]
+
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO hash VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class ContentHasher:
+    """
+    Hashes the files of the rename $[SHA1] / $[XXH] ... variables on a process pool, with a persistent cache
+
+        __init__(algorithms, jobs, cache)
+            - algorithms : the algorithms used by the template
+            - jobs       : the number of processes, defaults to the cpu count
+            - cache      : a HashCache or None
+
+        hash_entries(entries) : sets .hashes on every FileEntry (anything with .path and .stat())
+        summary()             : the files / MB hashed and the throughput in MB/s
+        close()               : stops the pool and closes the cache
+    """
+    def __init__(self, algorithms, *, jobs = None, cache = None) -> None:
+
+        self.algorithms = tuple(sorted(algorithms))
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cache = cache
+        self.pool = None
+
+        self.lock = threading.Lock()
+        self.files = 0
+        self.cached = 0
+        self.bytes = 0
+
+        # the wall time some hash_entries call was running, calls from several threads overlap so they are not added up
+        self.seconds = 0.0
+        self.running = 0
+        self.started = 0.0
+
+        # fail early if xxhash is missing
+        for i in self.algorithms:
+            new_hash(i)
+
+    def get_pool(self):
+
+        # multiprocessing is slow to import, so only when there is something to hash
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+
+            return self.pool
+
+    def hash_entries(self, entries):
+
+        with self.lock:
+            if self.running == 0:
+                self.started = time.perf_counter()
+
+            self.running += 1
+
+        try:
+            self._hash_entries(entries)
+
+        finally:
+            with self.lock:
+                self.running -= 1
+
+                if self.running == 0:
+                    self.seconds += time.perf_counter() - self.started
+
+    def _hash_entries(self, entries):
+
+        todo = {}
+        cached = 0
+
+        for entry in entries:
+
+            st = entry.stat()
+            path = os.path.abspath(entry.path)
+
+            hashes = self.cache.get(path, st.st_size, st.st_mtime_ns, self.algorithms) if self.cache else None
+
+            if hashes is not None:
+                entry.hashes = hashes
+                cached += 1
+                continue
+
+            todo[path] = (entry, st)
+
+        if len(todo) < MIN_POOL_FILES or self.jobs <= 1:
+            results = (_hash_worker(path, self.algorithms) for path in todo)
+
+        else:
+            pool = self.get_pool()
+
+            # the biggest files first so one large file does not finish last on its own
+            paths = sorted(todo, key=lambda x : todo[x][1].st_size, reverse=True)
+            results = pool.map(_hash_worker, paths, [self.algorithms] * len(paths), chunksize=4)
+
+        read = 0
+        done = []
+
+        for path, hashes in results:
+
+            (entry, st) = todo[path]
+            entry.hashes = hashes
+            read += st.st_size
+
+            done.append((path, st.st_size, st.st_mtime_ns, hashes))
+
+        if self.cache and done:
+            self.cache.put(done)
+
+        with self.lock:
+            self.files += len(todo)
+            self.cached += cached
+            self.bytes += read
+
+    def summary(self):
+
+        mb = self.bytes / (1 << 20)
+        rate = mb / self.seconds if self.seconds > 0 else 0
+
+        return f"hashed {self.files} files ({mb:.1f} MB) in {self.seconds:.2f}s ({rate:.1f} MB/s), {self.cached} from cache"
+
+    def close(self):
+
+        if self.pool is not None:
+            self.pool.shutdown()
+
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,426 @@
+import os
+import json
+import struct
+import threading
+from datetime import datetime
+
+from content_hash import DEFAULT_CACHE_FILE
+
+
+# the metadata is cached next to the hashes
+DEFAULT_METADATA_CACHE_FILE = os.path.join(os.path.dirname(DEFAULT_CACHE_FILE), "rename_metadata.db")
+
+# below this many files the thread pool is not worth starting
+MIN_POOL_FILES = 8
+
+# the exif tags that can be used as $[EXIF:Name]
+EXIF_TAGS = {
+    0x010F : "Make",
+    0x0110 : "Model",
+    0x0112 : "Orientation",
+    0x0131 : "Software",
+    0x0132 : "DateTime",
+    0x013B : "Artist",
+    0x829A : "ExposureTime",
+    0x829D : "FNumber",
+    0x8827 : "ISOSpeedRatings",
+    0x9003 : "DateTimeOriginal",
+    0x9004 : "DateTimeDigitized",
+    0x9011 : "OffsetTimeOriginal",
+    0x9291 : "SubSecTimeOriginal",
+    0x920A : "FocalLength",
+    0xA002 : "PixelXDimension",
+    0xA003 : "PixelYDimension",
+    0xA434 : "LensModel",
+}
+
+# points from IFD0 to the exif sub IFD
+EXIF_IFD_POINTER = 0x8769
+
+# how exif stores dates
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# the byte size of each exif value type
+EXIF_TYPE_SIZE = {1 : 1, 2 : 1, 3 : 2, 4 : 4, 5 : 8, 7 : 1, 9 : 4, 10 : 8}
+
+# jpeg start of frame markers, these hold the image size
+JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def parse_exif(data):
+    """Parses the tags of EXIF_TAGS from the TIFF data of a jpeg APP1 segment, returns a dict of name -> str"""
+
+    if len(data) < 8:
+        return {}
+
+    if data[:2] == b"II":
+        e = "<"
+
+    elif data[:2] == b"MM":
+        e = ">"
+
+    else:
+        return {}
+
+    tags = {}
+
+    def read_ifd(offset, follow):
+
+        if offset + 2 > len(data):
+            return
+
+        (count,) = struct.unpack_from(e + "H", data, offset)
+
+        for i in range(count):
+
+            pos = offset + 2 + i * 12
+
+            if pos + 12 > len(data):
+                return
+
+            (tag, kind, n) = struct.unpack_from(e + "HHI", data, pos)
+
+            if tag == EXIF_IFD_POINTER and follow:
+                read_ifd(struct.unpack_from(e + "I", data, pos + 8)[0], False)
+                continue
+
+            if tag not in EXIF_TAGS or kind not in EXIF_TYPE_SIZE:
+                continue
+
+            size = EXIF_TYPE_SIZE[kind] * n
+
+            # values of 4 bytes or less are stored in the entry itself
+            value_pos = pos + 8 if size <= 4 else struct.unpack_from(e + "I", data, pos + 8)[0]
+
+            if value_pos + size > len(data):
+                continue
+
+            if kind == 2:
+                value = data[value_pos:value_pos + size].split(b"\x00", 1)[0].decode("utf-8", "replace").strip()
+
+            elif kind == 3:
+                value = str(struct.unpack_from(e + "H", data, value_pos)[0])
+
+            elif kind in (4, 9):
+                value = str(struct.unpack_from(e + ("I" if kind == 4 else "i"), data, value_pos)[0])
+
+            elif kind in (5, 10):
+                (num, den) = struct.unpack_from(e + ("II" if kind == 5 else "ii"), data, value_pos)
+                value = f"{num / den:g}" if den else "0"
+
+            else:
+                continue
+
+            tags[EXIF_TAGS[tag]] = value
+
+    read_ifd(struct.unpack_from(e + "I", data, 4)[0], True)
+
+    return tags
+
+
+def read_jpeg(f, meta):
+    """Walks the jpeg segments by their lengths, reading only the exif segment and the start of frame"""
+
+    f.seek(2)
+
+    while True:
+
+        b = f.read(1)
+
+        # skip to the next marker, there can be fill bytes of 0xFF
+        while b and b != b"\xff":
+            b = f.read(1)
+
+        while b == b"\xff":
+            b = f.read(1)
+
+        if not b:
+            return
+
+        marker = b[0]
+
+        # markers without a length
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue
+
+        # end of image / start of scan, the size should have been found by now
+        if marker in (0xD9, 0xDA):
+            return
+
+        header = f.read(2)
+
+        if len(header) < 2:
+            return
+
+        length = struct.unpack(">H", header)[0] - 2
+
+        if marker == 0xE1 and "exif" not in meta:
+            data = f.read(length)
+
+            if data[:6] == b"Exif\x00\x00":
+                meta["exif"] = parse_exif(data[6:])
+
+        elif marker in JPEG_SOF:
+            data = f.read(5)
+
+            if len(data) == 5:
+                (meta["height"], meta["width"]) = struct.unpack(">HH", data[1:5])
+
+            return
+
+        else:
+            f.seek(length, 1)
+
+
+def read_webp(head, meta):
+
+    chunk = head[12:16]
+
+    if chunk == b"VP8 " and len(head) >= 30:
+        meta["width"] = struct.unpack("<H", head[26:28])[0] & 0x3FFF
+        meta["height"] = struct.unpack("<H", head[28:30])[0] & 0x3FFF
+
+    elif chunk == b"VP8L" and len(head) >= 25:
+        bits = struct.unpack("<I", head[21:25])[0]
+        meta["width"] = (bits & 0x3FFF) + 1
+        meta["height"] = ((bits >> 14) & 0x3FFF) + 1
+
+    elif chunk == b"VP8X" and len(head) >= 30:
+        meta["width"] = int.from_bytes(head[24:27], "little") + 1
+        meta["height"] = int.from_bytes(head[27:30], "little") + 1
+
+
+# mp4 boxes that hold the boxes we need
+MP4_CONTAINERS = {b"moov", b"trak"}
+
+
+def read_mp4(f, meta, start, end):
+    """Walks the mp4 / mov boxes by their sizes, only reading mvhd (duration) and tkhd (size)"""
+
+    pos = start
+
+    while pos + 8 <= end:
+
+        f.seek(pos)
+        header = f.read(8)
+
+        if len(header) < 8:
+            return
+
+        (size, kind) = struct.unpack(">I4s", header)
+        body = pos + 8
+
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            body += 8
+
+        elif size == 0:
+            size = end - pos
+
+        if size < 8:
+            return
+
+        if kind in MP4_CONTAINERS:
+            read_mp4(f, meta, body, pos + size)
+
+        elif kind == b"mvhd":
+            data = f.read(32)
+
+            if data[:1] == b"\x01":
+                (timescale, duration) = struct.unpack(">IQ", data[20:32])
+
+            else:
+                (timescale, duration) = struct.unpack(">II", data[12:20])
+
+            if timescale:
+                meta["duration"] = duration / timescale
+
+        elif kind == b"tkhd" and "width" not in meta:
+            data = f.read(92)
+            offset = 88 if data[:1] == b"\x01" else 76
+
+            if len(data) >= offset + 8:
+                (width, height) = struct.unpack(">II", data[offset:offset + 8])
+
+                # audio tracks have no size
+                if width and height:
+                    meta["width"] = width >> 16
+                    meta["height"] = height >> 16
+
+        pos += size
+
+
+def read_metadata(path):
+    """
+    Reads the size / duration / exif of an image or video from its headers without decoding it
+
+    supports jpeg, png, gif, webp and mp4 / mov, returns a dict with any of:
+        width, height, duration (seconds), exif (dict of name -> str)
+    """
+    meta = {}
+
+    with open(path, "rb") as f:
+
+        head = f.read(32)
+
+        if head[:8] == b"\x89PNG\r\n\x1a\n" and len(head) >= 24:
+            (meta["width"], meta["height"]) = struct.unpack(">II", head[16:24])
+
+        elif head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+            (meta["width"], meta["height"]) = struct.unpack("<HH", head[6:10])
+
+        elif head[:2] == b"\xff\xd8":
+            read_jpeg(f, meta)
+
+        elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            read_webp(head, meta)
+
+        elif head[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free"):
+            read_mp4(f, meta, 0, os.fstat(f.fileno()).st_size)
+
+    return meta
+
+
+def format_exif(value, fmt):
+    """Formats an exif value, dates are formatted with the given strftime format"""
+
+    try:
+        return datetime.strptime(value, EXIF_DATE_FORMAT).strftime(fmt)
+
+    except ValueError:
+        return value
+
+
+class MetadataCache:
+    """
+    A persistent (path, size, mtime) -> metadata cache stored in sqlite
+
+        get(path, size, mtime) : the metadata dict or None
+        put(files)             : store a list of (path, size, mtime, metadata) in one transaction
+        close()                : commit and close the database
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (
+        path  TEXT PRIMARY KEY,
+        size  INTEGER NOT NULL,
+        mtime INTEGER NOT NULL,
+        data  TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path = DEFAULT_METADATA_CACHE_FILE) -> None:
+
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, path, size, mtime):
+
+        with self.lock:
+            row = self.db.execute("SELECT data FROM metadata WHERE path = ? AND size = ? AND mtime = ?",
+                                  (path, size, mtime)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def put(self, files):
+
+        rows = [(path, size, mtime, json.dumps(meta)) for path, size, mtime, meta in files]
+
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", rows)
+
+    def close(self):
+
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def _read_or_empty(path):
+
+    try:
+        return read_metadata(path)
+
+    except (OSError, struct.error):
+        return {}
+
+
+class MetadataReader:
+    """
+    Reads the metadata used by the rename $[WIDTH] / $[EXIF:...] ... variables for a directory at once
+
+        __init__(jobs, cache)
+            - jobs  : the number of threads reading headers
+            - cache : a MetadataCache or None
+
+        read_entries(entries) : sets .metadata on every FileEntry (anything with .path and .stat())
+        summary()             : the files read and how many came from the cache
+        close()               : closes the cache
+    """
+    def __init__(self, *, jobs = 8, cache = None) -> None:
+
+        self.jobs = jobs
+        self.cache = cache
+
+        self.lock = threading.Lock()
+        self.files = 0
+        self.cached = 0
+
+    def read_entries(self, entries):
+
+        todo = {}
+        cached = 0
+
+        for entry in entries:
+
+            st = entry.stat()
+            path = os.path.abspath(entry.path)
+
+            meta = self.cache.get(path, st.st_size, st.st_mtime_ns) if self.cache else None
+
+            if meta is not None:
+                entry.metadata = meta
+                cached += 1
+                continue
+
+            todo[path] = (entry, st)
+
+        if len(todo) < MIN_POOL_FILES or self.jobs <= 1:
+            results = map(_read_or_empty, todo)
+
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # reading headers is mostly waiting on the disk, so threads are enough
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                results = list(pool.map(_read_or_empty, todo))
+
+        done = []
+
+        for path, meta in zip(list(todo), results):
+
+            (entry, st) = todo[path]
+            entry.metadata = meta
+
+            done.append((path, st.st_size, st.st_mtime_ns, meta))
+
+        if self.cache and done:
+            self.cache.put(done)
+
+        with self.lock:
+            self.files += len(todo)
+            self.cached += cached
+
+    def summary(self):
+
+        return f"read metadata of {self.files} files, {self.cached} from cache"
+
+    def close(self):
+
+        if self.cache is not None:
+            self.cache.close()
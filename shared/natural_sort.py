@@ -0,0 +1,39 @@
+from re import compile
+
+
+# splits the digits out of a name, the digits are at the odd indexes
+DIGIT_SPLIT = compile("([0-9]+)").split
+
+# between a text piece and the number after it, lower than any character of a filename
+TEXT_END = b"\x00"
+
+
+def natural_sort_key(s):
+    """
+    Gets a compact sort key for the given name, ex: file2 < file10
+
+    the key is bytes instead of a list of str / int so it is a single object per name,
+    it sorts the same as the old [int(text) if text.isdigit() else text.lower() ...] key:
+        - text pieces are lowercased utf-8 followed by TEXT_END
+        - numbers are their digits without leading zeros, prefixed by the digit count
+    """
+    parts = DIGIT_SPLIT(s)
+    key = bytearray()
+
+    for i, text in enumerate(parts):
+
+        if i % 2 == 0:
+
+            # the last piece is the end of the name, so it needs no TEXT_END
+            if i == len(parts) - 1:
+                key += text.lower().encode("utf-8", "surrogatepass")
+
+            else:
+                key += text.lower().encode("utf-8", "surrogatepass") + TEXT_END
+
+        else:
+            digits = text.lstrip("0").encode()
+
+            key += len(digits).to_bytes(2, "big") + digits
+
+    return bytes(key)
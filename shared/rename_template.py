@@ -0,0 +1,259 @@
+import os
+import random
+from re import compile
+from datetime import datetime
+
+
+# matches every template variable in a single scan:
+#    $[n:z] / $[n:i:z]          -> start, inc, end
+#    $[EXT]                     -> ext
+#    $[RND:n:z]                 -> lo, hi
+#    $[FDM] / $[FDC] / $[CD]    -> date (and fmt if given as $[FDM:%Y])
+#    $[SHA1] / $[SHA1:8] ...    -> hash (and hlen, the number of hex characters kept)
+#    $[SIZE]                    -> size
+#    $[WIDTH] / $[DURATION] ... -> meta
+#    $[EXIF:DateTimeOriginal]   -> exif (and efmt for dates, as $[EXIF:DateTimeOriginal:%Y])
+TOKEN_MATCH = compile(
+    r"\$\["
+    r"(?:(?P<start>-?\d+)(?:\:(?P<inc>-?\d+))?\:(?P<end>-?\d+)"
+    r"|(?P<ext>EXT)"
+    r"|RND\:(?P<lo>\d+)\:(?P<hi>\d+)"
+    r"|(?P<date>FDM|FDC|CD)(?:\:(?P<fmt>[^\]]+))?"
+    r"|(?P<hash>SHA1|SHA256|MD5|XXH)(?:\:(?P<hlen>\d+))?"
+    r"|(?P<size>SIZE)"
+    r"|(?P<meta>WIDTH|HEIGHT|DURATION)"
+    r"|EXIF\:(?P<exif>\w+)(?:\:(?P<efmt>[^\]]+))?"
+    r")\]"
+)
+
+# the opcodes of a compiled template
+LITERAL = 0
+COUNTER = 1
+EXT     = 2
+RND     = 3
+FDM     = 4
+FDC     = 5
+CD      = 6
+HASH    = 7
+SIZE    = 8
+META    = 9
+EXIF    = 10
+
+DATE_OPS = {"FDM" : FDM, "FDC" : FDC, "CD" : CD}
+
+
+def get_extension(name):
+    """Get the extension of a filename without the ., or an empty string"""
+    ext = name.rsplit(".", 1)
+
+    if len(ext) > 1:
+        return ext[-1]
+
+    return ""
+
+
+class Template:
+    """
+    A rename format compiled once into a list of (opcode, argument) tokens
+
+    every file is rendered in a single pass over the tokens and joined at the end,
+    instead of re-scanning the format with a regex for each variable
+
+        reset()              : resets the counters and refreshes the current date $[CD]
+        render(context, ext) : builds the name for the given file and increments the counters
+            - context : a FileEntry (anything with .name and .stat()) or a path
+            - ext     : overrides the extension used for $[EXT]
+
+        needs_stat : if rendering needs the stat of the file ($[FDM] / $[FDC] / $[SIZE])
+        hash_algorithms : the set of hashes used ($[SHA1] / $[XXH] ...), the hashes are read from
+                          context.hashes when it is set (see content_hash.ContentHasher), otherwise hashed here
+        needs_metadata : if rendering needs the image / video headers ($[WIDTH] / $[EXIF:...] ...), they are read from
+                         context.metadata when it is set (see media_metadata.MetadataReader), otherwise read here
+    """
+    def __init__(self, template : str, *, default_date_format = "%Y-%m-%d") -> None:
+
+        self.template = template
+        self.date_format = default_date_format
+
+        # list of (opcode, argument)
+        self.program = []
+
+        # list of (start, increment, end, zfill) for each counter
+        self.counters = []
+        self.counter_values = []
+
+        # list of the formats used by $[CD] so they are only formatted once
+        self.current_date_formats = []
+        self.current_dates = []
+
+        self.needs_stat = False
+        self.hash_algorithms = set()
+        self.needs_metadata = False
+
+        self._compile()
+        self.reset()
+
+    def _compile(self):
+
+        last = 0
+
+        for m in TOKEN_MATCH.finditer(self.template):
+
+            if m.start() > last:
+                self.program.append((LITERAL, self.template[last:m.start()]))
+
+            last = m.end()
+
+            if m.group("end") is not None:
+
+                start = int(m.group("start"))
+                end = int(m.group("end"))
+                increment = 1
+
+                if m.group("inc"):
+                    increment = int(m.group("inc"))
+
+                self.program.append((COUNTER, len(self.counters)))
+                self.counters.append((start, increment, end, len(str(end))))
+
+            elif m.group("ext"):
+                self.program.append((EXT, None))
+
+            elif m.group("lo") is not None:
+                self.program.append((RND, (int(m.group("lo")), int(m.group("hi")))))
+
+            elif m.group("hash"):
+                length = int(m.group("hlen")) if m.group("hlen") else None
+
+                self.program.append((HASH, (m.group("hash"), length)))
+                self.hash_algorithms.add(m.group("hash"))
+
+            elif m.group("size"):
+                self.program.append((SIZE, None))
+                self.needs_stat = True
+
+            elif m.group("meta"):
+                self.program.append((META, m.group("meta").lower()))
+                self.needs_metadata = True
+
+            elif m.group("exif"):
+                self.program.append((EXIF, (m.group("exif"), m.group("efmt") or self.date_format)))
+                self.needs_metadata = True
+
+            else:
+                op = DATE_OPS[m.group("date")]
+                fmt = m.group("fmt") or self.date_format
+
+                if op == CD:
+                    self.program.append((CD, len(self.current_date_formats)))
+                    self.current_date_formats.append(fmt)
+
+                else:
+                    self.program.append((op, fmt))
+                    self.needs_stat = True
+
+        if last < len(self.template):
+            self.program.append((LITERAL, self.template[last:]))
+
+    def reset(self):
+        """Resets all the counters and formats the current date"""
+
+        self.counter_values = [c[0] for c in self.counters]
+
+        now = datetime.now()
+        self.current_dates = [now.strftime(f) for f in self.current_date_formats]
+
+    def render(self, context, ext = None):
+        """Gets the name for the given file and increments all the counters"""
+
+        if isinstance(context, str):
+            name = os.path.basename(context)
+            path = context
+            get_stat = lambda: os.stat(path)
+            hashes = None
+            metadata = None
+
+        else:
+            name = context.name
+            path = context.path
+            get_stat = context.stat
+            hashes = getattr(context, "hashes", None)
+            metadata = getattr(context, "metadata", None)
+
+        st = None
+        parts = []
+
+        for op, arg in self.program:
+
+            if op == LITERAL:
+                parts.append(arg)
+
+            elif op == COUNTER:
+                value = self.counter_values[arg]
+                (_, increment, end, pad) = self.counters[arg]
+
+                parts.append(str(value).zfill(pad))
+
+                # if less than max increase by the increment amount
+                if value < end:
+                    self.counter_values[arg] = value + increment
+
+            elif op == EXT:
+                if ext is None:
+                    ext = get_extension(name)
+
+                parts.append(ext)
+
+            elif op == RND:
+                parts.append(str(random.randint(arg[0], arg[1])))
+
+            elif op == CD:
+                parts.append(self.current_dates[arg])
+
+            elif op == HASH:
+                if hashes is None:
+                    from content_hash import hash_file
+
+                    hashes = hash_file(path, sorted(self.hash_algorithms))
+
+                parts.append(hashes[arg[0]][:arg[1]])
+
+            elif op == SIZE:
+                if st is None:
+                    st = get_stat()
+
+                parts.append(str(st.st_size))
+
+            elif op == META or op == EXIF:
+                if metadata is None:
+                    from media_metadata import read_metadata
+
+                    metadata = read_metadata(path)
+
+                # files without the value (ex: $[DURATION] of a png) get an empty string
+                if op == META:
+                    value = metadata.get(arg)
+                    parts.append("" if value is None else str(round(value)))
+
+                else:
+                    from media_metadata import format_exif
+
+                    value = metadata.get("exif", {}).get(arg[0])
+                    parts.append("" if value is None else format_exif(value, arg[1]))
+
+            else:
+                if st is None:
+                    st = get_stat()
+
+                if op == FDM:
+                    parts.append(datetime.fromtimestamp(st.st_mtime).strftime(arg))
+
+                else:
+                    parts.append(datetime.fromtimestamp(st.st_ctime).strftime(arg))
+
+        return "".join(parts)
+
+
+def compile_template(template : str, **kwargs):
+    """Compiles the given format into a Template"""
+    return Template(template, **kwargs)
@@ -0,0 +1,121 @@
+
+# Measures the cost of rendering a single name with rename_template
+#
+#   python template_benchmark.py                  (100k names, every case)
+#   python template_benchmark.py -n 1000000 -c counter
+#
+# each case is rendered with the template compiled once (what the rename tools do),
+# and with the format parsed again for every name (what the old per-file regex scan did)
+
+import os
+import time
+
+from rename_template import compile_template
+
+
+# name -> format
+CASES = {
+    "counter" : "$[1:99999999].$[EXT]",
+    "date"    : "$[FDM:%Y-%m-%d_%H-%M-%S]_$[1:99999999].$[EXT]",
+    "mixed"   : "IMG_$[CD]_$[RND:0:999]_$[1:2:99999999]_$[SIZE].$[EXT]",
+    "hash"    : "$[SHA1:8]_$[XXH].$[EXT]",
+    "literal" : "no variables at all.txt",
+}
+
+DEFAULT_NAMES = 100_000
+
+
+class BenchEntry:
+    """A stand in for FileEntry with the stat / hashes already known, so only the rendering is measured"""
+
+    __slots__ = ("name", "path", "hashes", "metadata", "_stat")
+
+    def __init__(self, name, st) -> None:
+        self.name = name
+        self.path = name
+        self.hashes = {"SHA1" : "da39a3ee5e6b4b0d3255bfef95601890afd80709", "XXH" : "ef46db3751d8e999"}
+        self.metadata = {}
+        self._stat = st
+
+    def stat(self):
+        return self._stat
+
+
+def bench_compiled(format, entries):
+    """Returns the seconds taken to render every entry with a template compiled once"""
+
+    template = compile_template(format)
+    render = template.render
+
+    start = time.perf_counter()
+
+    for entry in entries:
+        render(entry)
+
+    return time.perf_counter() - start
+
+
+def bench_reparsed(format, entries):
+    """Returns the seconds taken to render every entry when the format is parsed again for each one"""
+
+    start = time.perf_counter()
+
+    for entry in entries:
+        compile_template(format).render(entry)
+
+    return time.perf_counter() - start
+
+
+def get_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]...",
+        add_help=False,
+    )
+
+    general = parser.add_argument_group("General Options")
+    general.add_argument(
+        "-h", "--help",
+        action="help",
+        help="Print this help message and exit",
+    )
+
+    bench_ops = parser.add_argument_group("Benchmark Options")
+    bench_ops.add_argument(
+        "-n", "--names",
+        dest="names", metavar="N", type=int, default=DEFAULT_NAMES,
+        help="Number of names rendered per case (default %(default)s)"
+    )
+    bench_ops.add_argument(
+        "-c", "--case",
+        dest="cases", choices=tuple(CASES), action="append",
+        help="Format to benchmark, multiple -c can be specified (default all)"
+    )
+
+    return parser
+
+
+def main(_args = None):
+
+    parser = get_parser()
+    args = parser.parse_args(_args)
+
+    cases = args.cases or tuple(CASES)
+
+    st = os.stat(__file__)
+    entries = [BenchEntry(f"file_{i}.jpg", st) for i in range(args.names)]
+
+    print("{0:<9}{1:>14}{2:>14}{3:>10}".format("case", "compiled ns", "reparsed ns", "speedup"))
+
+    for case in cases:
+
+        compiled = bench_compiled(CASES[case], entries)
+        reparsed = bench_reparsed(CASES[case], entries)
+
+        print("{0:<9}{1:>14.0f}{2:>14.0f}{3:>9.1f}x".format(
+            case, compiled / len(entries) * 1e9, reparsed / len(entries) * 1e9, reparsed / compiled if compiled > 0 else 0), flush=True)
+
+
+if __name__ == "__main__":
+    main()